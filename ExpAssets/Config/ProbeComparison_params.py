@@ -8,6 +8,9 @@ manual_demographics_collection = False
 manual_trial_generation = False
 run_practice_blocks = True
 multi_user = True
+resume_session = False # set to True to resume the last incomplete session on this station
+collector_address = None # e.g. "127.0.0.1:5555" to stream trial data to tools/collector.py
+collector_flush_wait = 0.5 # max seconds to wait for the collector at the start of each block
 view_distance = 57 # in centimeters, 57cm = 1 deg of visual angle per cm of screen
 
 #########################################
@@ -81,7 +84,36 @@ datafile_ext = ".txt"
 stim_duration = 250 # ms
 trial_duration = 1150 # ms
 target = 3
+digits = [1, 2, 3, 4, 5, 6, 7, 8, 9]
+digit_sizes = ['1.5deg', '2.0deg', '2.5deg', '3.0deg', '3.5deg']
+practice_trials = 9 # trials per practice block
 
-# trials_per_block should be a multiple of probe_span + noprobe_span
+# constraints on the session's sequence of digits and digit sizes
+max_digit_run = 1 # max times in a row the same digit can be shown
+max_size_run = 2 # max times in a row the same digit size can be shown
+min_target_gap = 4 # minimum trials from one target to the next
+
+# probes are scheduled across the whole session, one at a random position within every
+# probe_span trials, with noprobe_span probe-free trials in between
 probe_span = 48 # 48 now
 noprobe_span = 18 # minimum trials between probes
+probe_min_interval = 20 # seconds, checked against noprobe_span and trial_duration
+
+# Scripted participant for automated test runs and benchmarking (run with -d to skip
+# demographics). Writes a throughput report to ExpAssets/Data at the end of the session.
+virtual_participant = False
+vp_rt_mean = 380 # ms
+vp_rt_sd = 80 # ms
+vp_commission_rate = 0.4 # proportion of targets responded to
+vp_omission_rate = 0.02 # proportion of non-targets not responded to
+vp_probe_rt = 1500 # ms
+vp_speed = 1.0 # how many times faster than real time to run the task (e.g. 10)
+vp_busy_frames = False # redraw held screens every frame, to benchmark CPU usage against
+
+# Times each phase of the session (setup, blocks, trials, probes, and the rendering, input
+# and database work within them), writing a report to ExpAssets/Data/profile at the end.
+profile_phases = False
+
+# Logs every keyboard and mouse event of the session to a compact binary file in
+# ExpAssets/Data/events (readable with tools/events.py).
+log_input_events = True
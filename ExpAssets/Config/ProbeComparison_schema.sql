@@ -57,12 +57,28 @@ CREATE TABLE trials (
   practicing boolean not null,
   block_num integer not null,
   trial_num integer not null,
-  digit text not null,
+  digit integer not null,
   digit_size text not null,
-  target_digit text not null,
+  target_digit integer not null,
   response text not null,
-  rt text not null,
-  accuracy text not null,
-	probe_resp text not null,
-	probe_rt text not null
+  rt real,
+  input_lag_ms real,
+  accuracy boolean not null,
+  probe_resp text,
+  probe_rt real,
+  stim_ms real,
+  trial_ms real,
+  late_frames integer
+);
+
+CREATE TABLE probe_trajectories (
+  id integer primary key autoincrement not null,
+  participant_id integer not null references participants(id),
+  block_num integer not null,
+  trial_num integer not null,
+  n_samples integer not null,
+  path_length real not null,
+  first_move_ms integer,
+  answer_changes integer,
+  samples blob not null
 );
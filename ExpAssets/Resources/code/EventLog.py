@@ -0,0 +1,159 @@
+__author__ = "Austin Hurst"
+
+import os
+import struct
+
+import numpy as np
+
+try:
+    from time import perf_counter_ns
+except ImportError:
+    # Fallbacks for Python < 3.7 (same clock as FrameTiming, which needs klibs to import)
+    try:
+        from time import perf_counter as _clock
+    except ImportError:
+        from time import time as _clock
+    def perf_counter_ns():
+        return int(_clock() * 1e9)
+
+# SDL2 event type codes for the input events that get logged
+EVENT_TYPES = {
+    0x300: 'key_down', 0x301: 'key_up', 0x400: 'mouse_motion', 0x401: 'mouse_down',
+    0x402: 'mouse_up', 0x403: 'mouse_wheel'
+}
+
+# Fixed-width (32 byte) little-endian record for a single input event
+EVENT_DTYPE = np.dtype([
+    ('block', '<i2'),    # block number (0 outside of blocks)
+    ('trial', '<i2'),    # trial number (0 outside of trials)
+    ('type', '<u4'),     # SDL event type (see EVENT_TYPES)
+    ('code', '<i4'),     # key code, mouse button, or 0 for motion/wheel events
+    ('x', '<i4'),        # mouse x position or wheel x amount (0 for key events)
+    ('y', '<i4'),        # mouse y position or wheel y amount (0 for key events)
+    ('sdl_ms', '<u4'),   # SDL event timestamp (ms since SDL init)
+    ('perf_ns', '<i8'),  # perf_counter_ns() when the event was read from the queue
+])
+
+MAGIC = b"PCEVLOG\x00"
+VERSION = 1
+HEADER = struct.Struct("<8sII") # magic, version, record size
+
+
+class EventLog(object):
+    """A compact binary log of every input event received during a session.
+
+    Events are copied from each event queue passed to :meth:`record` into a preallocated
+    NumPy structured array, which is appended to the log file whenever :meth:`flush` is
+    called (e.g. at the start of each block) or whenever it fills up. Each record is a
+    fixed-width row of :data:`EVENT_DTYPE`, so logs can be read back without any parsing
+    with :func:`read_log`.
+
+    The log does nothing until :meth:`open` is called, so input code can record to it
+    unconditionally.
+
+    Args:
+        capacity (int, optional): The number of events to buffer in memory between writes.
+
+    """
+    def __init__(self, capacity=8192):
+        self.path = None
+        self.block = 0
+        self.trial = 0
+        self._buffer = np.zeros(capacity, dtype=EVENT_DTYPE)
+        self._count = 0
+        self.written = 0
+
+    def open(self, path):
+        """Starts logging events to a given file, creating it if it doesn't exist.
+
+        """
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        if not os.path.isfile(path) or os.path.getsize(path) == 0:
+            with open(path, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, VERSION, EVENT_DTYPE.itemsize))
+        self.path = path
+
+    def set_trial(self, block, trial):
+        """Sets the block and trial numbers to log with all subsequent events.
+
+        """
+        self.block = block
+        self.trial = trial
+
+    def record(self, queue):
+        """Copies any input events in an event queue into the log buffer.
+
+        """
+        if self.path is None:
+            return
+        now = perf_counter_ns()
+        for e in queue:
+            if e.type not in EVENT_TYPES:
+                continue
+            if self._count == len(self._buffer):
+                self.flush()
+            row = self._buffer[self._count]
+            row['block'] = self.block
+            row['trial'] = self.trial
+            row['type'] = e.type
+            if e.type in (0x300, 0x301):
+                row['code'] = e.key.keysym.sym
+                row['x'], row['y'] = 0, 0
+                row['sdl_ms'] = e.key.timestamp
+            elif e.type == 0x400:
+                row['code'] = 0
+                row['x'], row['y'] = e.motion.x, e.motion.y
+                row['sdl_ms'] = e.motion.timestamp
+            elif e.type == 0x403:
+                row['code'] = 0
+                row['x'], row['y'] = e.wheel.x, e.wheel.y
+                row['sdl_ms'] = e.wheel.timestamp
+            else:
+                row['code'] = e.button.button
+                row['x'], row['y'] = e.button.x, e.button.y
+                row['sdl_ms'] = e.button.timestamp
+            row['perf_ns'] = now
+            self._count += 1
+
+    def flush(self):
+        """Appends all buffered events to the log file.
+
+        """
+        if self.path is None or self._count == 0:
+            return
+        with open(self.path, 'ab') as f:
+            f.write(self._buffer[:self._count].tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        self.written += self._count
+        self._count = 0
+
+    def close(self):
+        self.flush()
+        self.path = None
+
+
+def read_log(path):
+    """Memory-maps an event log as a read-only NumPy structured array of
+    :data:`EVENT_DTYPE` records.
+
+    A partially-written last record (e.g. from a crash mid-write) is ignored.
+
+    """
+    with open(path, 'rb') as f:
+        header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ValueError("'{0}' is not an event log.".format(path))
+    magic, version, itemsize = HEADER.unpack(header)
+    if magic != MAGIC or itemsize != EVENT_DTYPE.itemsize:
+        raise ValueError("'{0}' is not a version {1} event log.".format(path, VERSION))
+    count = (os.path.getsize(path) - HEADER.size) // itemsize
+    if count == 0:
+        return np.zeros(0, dtype=EVENT_DTYPE)
+    return np.memmap(path, dtype=EVENT_DTYPE, mode='r', offset=HEADER.size, shape=(count,))
+
+
+# Shared input event log for the session
+event_log = EventLog()
@@ -0,0 +1,83 @@
+__author__ = "Austin Hurst"
+
+from klibs.KLGraphics import flip
+
+try:
+    from time import perf_counter_ns
+except ImportError:
+    # Fallbacks for Python < 3.7
+    try:
+        from time import perf_counter as _clock
+    except ImportError:
+        from time import time as _clock
+    def perf_counter_ns():
+        return int(_clock() * 1e9)
+
+
+class FrameTimer(object):
+    """Records high-resolution timestamps for screen flips and trial events.
+
+    Named events (e.g. stimulus onset, mask onset, or the end of a trial) are stamped with a
+    monotonic nanosecond clock, with flips stamped as soon as they return. Dropped frames
+    show up as stamped intervals that run over their target durations (see
+    :meth:`late_frames`).
+
+    Args:
+        refresh_rate (float): The refresh rate of the display (in Hz).
+
+    """
+    def __init__(self, refresh_rate):
+        self.frame_ns = int(1e9 / refresh_rate)
+        self.events = {}
+
+    def start_trial(self):
+        """Clears all recorded events from the previous trial.
+
+        """
+        self.events = {}
+
+    def stamp(self, label, t=None):
+        """Records the time of a named event, if not already recorded this trial.
+
+        Returns:
+            int: The timestamp of the event (in nanoseconds).
+
+        """
+        if label not in self.events:
+            self.events[label] = perf_counter_ns() if t == None else t
+        return self.events[label]
+
+    def flip(self, label=None):
+        """Flips the screen and records the time the flip returned.
+
+        If a label is given, the flip time is also stamped as the onset of that event.
+
+        Returns:
+            int: The timestamp of the flip (in nanoseconds).
+
+        """
+        flip()
+        t = perf_counter_ns()
+        if label:
+            self.stamp(label, t)
+        return t
+
+    def elapsed_ms(self, start, end):
+        """Returns the time (in ms) between two stamped events, or None if either event
+        did not occur during the trial.
+
+        """
+        if start not in self.events or end not in self.events:
+            return None
+        return (self.events[end] - self.events[start]) / 1e6
+
+    def late_frames(self, start, end, target_ms):
+        """Returns the number of whole refresh periods by which the interval between two
+        events exceeded its target duration (e.g. frames dropped from a stimulus).
+
+        """
+        actual = self.elapsed_ms(start, end)
+        if actual == None:
+            return None
+        late = int(round((actual - target_ms) * 1e6 / self.frame_ns))
+        return max(late, 0)
@@ -1,8 +1,8 @@
 __author__ = "Austin Hurst"
 
 from klibs import P
-from klibs.KLBoundary import BoundaryInspector, RectangleBoundary, CircleBoundary
-from klibs.KLGraphics import fill, blit, flip, clear
+from klibs.KLBoundary import RectangleBoundary
+from klibs.KLGraphics import fill, blit, flip
 from klibs.KLGraphics import KLDraw as kld
 from klibs.KLGraphics.KLNumpySurface import NumpySurface as NpS
 from klibs.KLCommunication import message
@@ -11,9 +11,20 @@ from klibs.KLUtilities import pump, show_mouse_cursor, hide_mouse_cursor, mouse_
 from klibs.KLUtilities import line_segment_len as lsl
 from klibs.KLResponseCollectors import Response
 
+from StaticFrame import needs_redraw, window_changed
+from StimulusAtlas import flatten
+from FrameTiming import perf_counter_ns
+from TextCache import text_cache
+from MouseTrajectory import MouseTrajectory
+from PhaseProfiler import profiled
+from EventLog import event_log
+
 import random
 import time
 import sdl2
+from bisect import bisect_right
+
+import numpy as np
 
 MED_GREY = (128, 128, 128, 255)
 LIGHT_GREY = (192, 192, 192, 255)
@@ -21,14 +32,122 @@ TRANSLUCENT_GREY = (192, 192, 192, 64)
 TRANSLUCENT_BLUE = (0, 0, 128, 128)
 
 
+class SurfaceCache(object):
+    """A cache of pre-rendered shape surfaces for interface widgets.
+
+    Surfaces are keyed by shape, geometry, and fill colour, so identical shapes are only
+    ever rasterized once. Widgets own their caches and clear them whenever their layout
+    changes.
+
+    """
+    def __init__(self):
+        self._surfaces = {}
+
+    def _get(self, key, shape):
+        if key not in self._surfaces:
+            self._surfaces[key] = shape().render()
+        return self._surfaces[key]
+
+    def rectangle(self, width, height, fill):
+        key = ('rectangle', int(width), int(height), tuple(fill))
+        return self._get(key, lambda: kld.Rectangle(int(width), int(height), fill=fill))
+
+    def ellipse(self, diameter, fill):
+        key = ('ellipse', int(diameter), tuple(fill))
+        return self._get(key, lambda: kld.Ellipse(int(diameter), fill=fill))
+
+    def clear(self):
+        self._surfaces = {}
+
+
+class RowIndex(object):
+    """A hit-testing index for a vertical stack of rows with the same horizontal extent.
+
+    Each lookup is a single binary search over the row edges, regardless of how many
+    boundaries the rows would otherwise need.
+
+    Args:
+        x1 (int): The left edge of the rows.
+        x2 (int): The right edge of the rows.
+        rows (list): A list of (label, top, bottom) tuples, sorted from top to bottom.
+
+    """
+    def __init__(self, x1, x2, rows):
+        self.x1 = x1
+        self.x2 = x2
+        self.labels = [r[0] for r in rows]
+        self.tops = [r[1] for r in rows]
+        self.bottoms = [r[2] for r in rows]
+
+    def which(self, pos):
+        x, y = pos
+        if not (self.x1 <= x <= self.x2):
+            return None
+        i = bisect_right(self.tops, y) - 1
+        if i >= 0 and y <= self.bottoms[i]:
+            return self.labels[i]
+        return None
+
+    def which_all(self, x, y):
+        """Hit-tests arrays of x and y coordinates at once, returning an array of the
+        indices of the rows containing each point (or -1 for points outside all rows).
+
+        """
+        i = np.searchsorted(self.tops, y, side='right') - 1
+        bottoms = np.asarray(self.bottoms)[np.clip(i, 0, len(self.bottoms) - 1)]
+        inside = (x >= self.x1) & (x <= self.x2) & (i >= 0) & (y <= bottoms)
+        return np.where(inside, i, -1)
+
+
+class CircleRowIndex(object):
+    """A hit-testing index for a horizontal row of evenly-spaced circles of equal size.
+
+    Each lookup computes the nearest circle directly from the x coordinate, and then checks
+    whether the point falls within that circle.
+
+    Args:
+        labels (list): The labels of the circles, from left to right.
+        centers (list): The (x, y) centres of the circles, from left to right.
+        radius (float): The radius of the circles.
+
+    """
+    def __init__(self, labels, centers, radius):
+        self.labels = list(labels)
+        self.centers = list(centers)
+        self.radius = radius
+        self.x0 = centers[0][0]
+        n = len(centers)
+        self.pitch = float(centers[-1][0] - self.x0) / (n - 1) if n > 1 else 1.0
+
+    def which(self, pos):
+        x, y = pos
+        n = int(round((x - self.x0) / self.pitch))
+        n = min(max(n, 0), len(self.centers) - 1)
+        cx, cy = self.centers[n]
+        if (x - cx) ** 2 + (y - cy) ** 2 <= self.radius ** 2:
+            return self.labels[n]
+        return None
+
+    def which_all(self, x, y):
+        """Hit-tests arrays of x and y coordinates at once, returning an array of the
+        indices of the circles containing each point (or -1 for points outside all circles).
+
+        """
+        n = np.rint((x - self.x0) / self.pitch).astype(np.int64)
+        n = np.clip(n, 0, len(self.centers) - 1)
+        centers = np.asarray(self.centers, dtype=np.float64)[n]
+        inside = (x - centers[:, 0]) ** 2 + (y - centers[:, 1]) ** 2 <= self.radius ** 2
+        return np.where(inside, n, -1)
+
+
 class Button(object):
     
     def __init__(self, msg, width, height=None, registration=5, location=None):
         
         self.width = width
         self.height = height if height else width
-        self.hover = kld.Rectangle(self.width, self.height, fill=TRANSLUCENT_GREY)
         self.msg = msg
+        self._cache = SurfaceCache()
         
         self.__registration = registration
         self.__location = location if location else P.screen_c
@@ -55,6 +174,9 @@ class Button(object):
         self.x2 = self.midpoint[0] + self.width//2
         self.y2 = self.midpoint[1] + self.height//2
         self.bounds = RectangleBoundary("button", (self.x1, self.y1), (self.x2, self.y2))
+
+        self._cache.clear()
+        self.hover = self._cache.rectangle(self.width, self.height, TRANSLUCENT_GREY)
         
         
     def draw(self):
@@ -90,11 +212,10 @@ class Button(object):
 
 
 
-class LikertType(BoundaryInspector):
+class LikertType(object):
 
-    def __init__(self, first, last, width, height, style, registration=None, location=None):
-
-        BoundaryInspector.__init__(self)
+    def __init__(self, first, last, width, height, style, registration=None, location=None,
+                 labels=None):
 
         self.range = range(first, last+1, 1)
         self.count = len(self.range)
@@ -104,27 +225,53 @@ class LikertType(BoundaryInspector):
         self.width = width
         self.circle_size = self.height
         self.gap = (width - self.circle_size * self.count) / (self.count - 1)
+        self._cache = SurfaceCache()
         
         self.__location = location if location else P.screen_c
         self.__registration = registration if registration else 5
         self.__init_bounds()
 
-        numlist = []
-        for num in self.range:
-            num_txt = message("{0}".format(num), style, blit_txt=False)
-            numlist.append((num, num_txt))
-        self.numbers = dict(numlist)
-
-        self.selected = kld.Ellipse(self.circle_size-4, fill=TRANSLUCENT_GREY)
-        self.mouseover = self.selected#kld.Annulus(self.circle_size-4, 6, fill=MED_GREY)
+        # Use pre-rendered number surfaces if provided, otherwise render them here
+        if labels:
+            self.numbers = dict((num, labels[num]) for num in self.range)
+        else:
+            numlist = []
+            for num in self.range:
+                num_txt = message("{0}".format(num), style, blit_txt=False)
+                numlist.append((num, num_txt))
+            self.numbers = dict(numlist)
 
     def __render__(self):
         for num in self.range:
             pos = self.__num_to_pos(num)
             blit(self.numbers[num], location=pos, registration=5)
+        self.draw_overlay(None)
+
+    def static_items(self):
+        """Returns the parts of the scale that never change appearance (i.e. the numbers),
+        as a list of (surface, registration, location) tuples.
+
+        """
+        return [(self.numbers[num], 5, self.__num_to_pos(num)) for num in self.range]
+
+    def hovered(self):
+        return self._index.which(mouse_pos())
+
+    def draw_overlay(self, hover):
+        """Draws the highlights for the selected number and the number under the cursor.
+
+        """
         if self.response != None:
-            pos = self.__num_to_pos(self.response)
-            blit(self.selected, location=pos, registration=5)
+            blit(self.selected, location=self.__num_to_pos(self.response), registration=5)
+        if hover != None:
+            blit(self.mouseover, 5, self.__num_to_pos(hover))
+
+    def listen(self, queue):
+        for e in queue:
+            if e.type == sdl2.SDL_MOUSEBUTTONDOWN:
+                clicked = self._index.which((e.button.x, e.button.y))
+                if clicked != None:
+                    self.response = clicked
 
     def __init_bounds(self):
         if self.registration in [7, 4, 1]:
@@ -146,10 +293,13 @@ class LikertType(BoundaryInspector):
         self.x2 = self.midpoint[0] + self.width//2
         self.y2 = self.midpoint[1] + self.height//2
 
-        for num in self.range:
-            pos = self.__num_to_pos(num)
-            bounds = CircleBoundary(str(num), pos, (self.circle_size*0.6))
-            self.add_boundary(bounds)
+        # Replace the whole hit-testing index at once, so old bounds never linger
+        positions = [self.__num_to_pos(num) for num in self.range]
+        self._index = CircleRowIndex(list(self.range), positions, self.circle_size*0.6)
+
+        self._cache.clear()
+        self.selected = self._cache.ellipse(self.circle_size-4, TRANSLUCENT_GREY)
+        self.mouseover = self.selected#kld.Annulus(self.circle_size-4, 6, fill=MED_GREY)
     
     def __num_to_pos(self, num):
         n = self.range.index(num)
@@ -157,14 +307,15 @@ class LikertType(BoundaryInspector):
         y_pos = self.y1 + int(self.circle_size * 0.5)
         return (x_pos, y_pos)
 
+    def targets(self):
+        return dict((num, self.__num_to_pos(num)) for num in self.range)
+
     def response_listener(self, queue):
         self.__render__()
-        num = self.which_boundary(mouse_pos())
+        num = self.hovered()
         if num != None:
-            blit(self.mouseover, 5, self.__num_to_pos(int(num)))
-            for e in queue:
-                if e.type == sdl2.SDL_MOUSEBUTTONDOWN:
-                    self.response = int(num)
+            blit(self.mouseover, 5, self.__num_to_pos(num))
+        self.listen(queue)
     
     @property
     def location(self):
@@ -187,60 +338,95 @@ class LikertType(BoundaryInspector):
 
 
 class Slider(object):
-
+    """A horizontal slider with an optional set of evenly-spaced tick marks.
+
+    The line and ticks are rendered together into a single cached track surface, so the
+    number of ticks has no effect on the cost of drawing the slider. While dragging, the
+    slider's position is taken from the most recent mouse motion event in each queue
+    passed to :meth:`listen`, so drawing it never needs to poll the mouse.
+
+    Args:
+        width (int): The width of the slider track.
+        diameter (int, optional): The diameter of the slider button.
+        fills (dict, optional): Colours to use for the 'line' and 'slider' button, if
+            not the defaults.
+        ticks (int, optional): The number of tick marks to draw along the track.
+        location (tuple, optional): The screen location of the centre of the slider.
+
+    """
     def __init__(self, width, diameter=60, fills={}, ticks=None, location=None):
+        self._track = None
         self.width = width
         self.ticks = ticks
         self.location = location if location else P.screen_c
 
         _fills = {'line': MED_GREY, 'slider': TRANSLUCENT_BLUE}
         _fills.update(fills) # override default colours if fills provided
-        self.line = kld.Rectangle(width, 2, fill=_fills['line'])
-        self.tick = kld.Rectangle(2, int(diameter/2), fill=_fills['line'])
-        self.button = kld.Ellipse(diameter, fill=_fills['slider'])
+        self.diameter = diameter
+        self._fills = _fills
+        self._cache = SurfaceCache()
+        self.button = self._cache.ellipse(diameter, _fills['slider'])
 
         self.__clicked = False
         self.__dragging = False
         self.__drag_offset = 0
+        self.__drag_x = self.location[0]
         self.__abs_pos = self.location
 
-    def _draw_ticks(self):
+    def _tick_positions(self):
+        # x offsets of each tick's centre from the left end of the track
+        if not self.ticks:
+            return np.zeros(0, dtype=np.int64)
         if self.ticks == 1:
-            blit(self.tick, 5, self.location)
-        elif self.ticks >= 2:
-            blit(self.tick, 5, (self.xmin, self.location[1]))
-            blit(self.tick, 5, (self.xmax, self.location[1]))
-            if self.ticks > 2:
-                spacing = float(self.width) / (self.ticks-1)
-                for i in range(1, self.ticks-1):
-                    blit(self.tick, 5, (self.xmin+int(spacing*i), self.location[1]))
-        
+            return np.array([self.location[0] - self.xmin])
+        return np.linspace(0, self.xmax - self.xmin, self.ticks).astype(np.int64)
+
+    def _render_track(self):
+        # Renders the line and ticks into one surface, with a 1px margin on either end
+        # so the first and last ticks (2px wide, centred on the ends) aren't cut off
+        h = max(int(self.diameter/2), 2)
+        span = self.xmax - self.xmin
+        track = np.zeros((h, span + 2, 4), dtype=np.uint8)
+        colour = np.asarray(self._fills['line'], dtype=np.uint8)
+        track[h//2 - 1:h//2 + 1, 1:span + 1] = colour
+        cols = (self._tick_positions()[:, None] + np.arange(2)).ravel()
+        track[:, cols] = colour
+        corner = (self.xmin - 1, self.location[1] - h//2)
+        return (track, corner)
+
     def draw(self):
-        blit(self.line, 5, self.location)
-        if self.ticks:
-            self._draw_ticks()
+        if self._track is None:
+            self._track = self._render_track()
+        track, corner = self._track
+        blit(track, 7, corner)
         if self.__clicked:
-            mp = mouse_pos()
             if self.__dragging:
-                new_xpos = clip(mp[0]+self.__drag_offset, self.xmin, self.xmax)
-                blit(self.button, 5, (new_xpos, self.location[1]))
+                blit(self.button, 5, (self.__drag_x, self.location[1]))
             else:
                 blit(self.button, 5, self.__abs_pos)
-        
+
     def listen(self, queue):
+        motion_x = None
         for e in queue:
             if e.type == sdl2.SDL_MOUSEBUTTONDOWN:
                 click_pos = (e.button.x, e.button.y)
-                if abs(click_pos[1]-self.location[1]) < self.button.diameter/2:
+                if abs(click_pos[1]-self.location[1]) < self.diameter/2:
                     if self.xmin <= click_pos[0] <= self.xmax:
                         self.__abs_pos = (click_pos[0], self.location[1])
                         self.__clicked = True
                         self.__dragging = True
                         self.__drag_offset = 0
-                    elif lsl(click_pos, self.__abs_pos) < self.button.diameter/2:
-                       self.__clicked = True
-                       self.__dragging = True
-                       self.__drag_offset = self.__abs_pos[0] - click_pos[0]
+                        self.__drag_x = click_pos[0]
+                    elif lsl(click_pos, self.__abs_pos) < self.diameter/2:
+                        self.__clicked = True
+                        self.__dragging = True
+                        self.__drag_offset = self.__abs_pos[0] - click_pos[0]
+                        self.__drag_x = self.__abs_pos[0]
+                motion_x = None
+
+            elif e.type == sdl2.SDL_MOUSEMOTION:
+                # Only the last motion event in the queue matters for drawing
+                motion_x = e.motion.x
 
             elif e.type == sdl2.SDL_MOUSEBUTTONUP:
                 if self.__dragging:
@@ -248,11 +434,35 @@ class Slider(object):
                     new_xpos = clip(release_pos[0]+self.__drag_offset, self.xmin, self.xmax)
                     self.__abs_pos = (new_xpos, self.location[1])
                     self.__dragging = False
+                motion_x = None
+
+        if self.__dragging and motion_x != None:
+            self.__drag_x = clip(motion_x + self.__drag_offset, self.xmin, self.xmax)
         return False
 
     def reset(self):
         self.__clicked = False
-                
+
+    @property
+    def width(self):
+        return self.__width
+
+    @width.setter
+    def width(self, w):
+        self.__width = w
+        self._track = None
+        if hasattr(self, '_Slider__location'):
+            self.location = self.__location
+
+    @property
+    def ticks(self):
+        return self.__ticks
+
+    @ticks.setter
+    def ticks(self, n):
+        self.__ticks = n
+        self._track = None
+
     @property
     def location(self):
         return self.__location
@@ -262,6 +472,7 @@ class Slider(object):
         self.__location = loc
         self.xmin = loc[0] - self.width//2
         self.xmax = loc[0] + self.width//2
+        self._track = None
 
     @property
     def pos(self):
@@ -278,11 +489,9 @@ class Slider(object):
 
 
 
-class ThoughtProbe(BoundaryInspector):
-
-    def __init__(self, choices, question, width, origin, order=None):
+class ThoughtProbe(object):
 
-        BoundaryInspector.__init__(self)
+    def __init__(self, choices, question, width, origin, order=None, labels=None):
 
         self.q = question
         self.width = width
@@ -292,62 +501,176 @@ class ThoughtProbe(BoundaryInspector):
             order = list(choices.keys())
             random.shuffle(order)
         self.order = order
+        self._cache = SurfaceCache()
+        self.trajectory = MouseTrajectory()
 
-        self.q_pad = 0.8 * message("ABCDEFG", "normal", blit_txt=False).height
+        self.q_pad = 0.8 * text_cache.render("ABCDEFG", "normal").height
         x1 = origin[0] - width//2
         x2 = origin[0] + width//2     
         y1 = origin[1] + self.q.height + self.q_pad * 2
        
         self.answers = {}
+        rows = []
         for a in order:
-            txt = message(choices[a], "normal", blit_txt=False, wrap_width=(width-self.q_pad//2), align='center')
+            if labels:
+                txt = labels[a]
+            else:
+                txt = message(choices[a], "normal", blit_txt=False, wrap_width=(width-self.q_pad//2), align='center')
             y2 = y1 + txt.height + self.q_pad
-            bounds = RectangleBoundary(a, (x1, y1), (x2, y2))
-            self.add_boundary(bounds)
-            self.answers[a] = {'text': txt, 'location': (origin[0], y1), 'height': y2-y1}
+            rows.append((a, y1, y2))
+            hover = self._cache.rectangle(self.width, y2-y1, TRANSLUCENT_GREY)
+            self.answers[a] = {
+                'text': txt, 'location': (origin[0], y1), 'height': y2-y1, 'hover': hover
+            }
             y1 = y2
+        self._index = RowIndex(x1, x2, rows)
+        self._static = None
 
 
-    def _render(self):
+    def _static_layer(self):
+
+        # The question and answers never change, so they're flattened into a single
+        # surface the first time they're drawn
+        if self._static is None:
+            items = [(self.q, 8, self.origin)]
+            for ans in self.order:
+                ax, ay = self.answers[ans]['location']
+                items.append((self.answers[ans]['text'], 8, (ax, ay + int(self.q_pad*0.55))))
+            self._static = flatten(items)
+        return self._static
 
-        blit(self.q, location=self.origin, registration=8)
-        for ans in self.order:
-            a = self.answers[ans]
-            ax, ay = a['location']
-            blit(a['text'], location=(ax, ay + int(self.q_pad*0.55)), registration=8)
 
-        mouseover = self.which_boundary(mouse_pos())
+    def _render(self, mouseover=None):
+
+        layer, corner = self._static_layer()
+        blit(layer, 7, corner)
         if mouseover != None:
             a = self.answers[mouseover]
-            hover = kld.Rectangle(self.width, a['height'], fill=TRANSLUCENT_GREY).render()
-            blit(hover, 8, a['location'])
+            blit(a['hover'], 8, a['location'])
+
+
+    def labels(self):
+        return dict((ans, a['text']) for ans, a in self.answers.items())
 
+    def trajectory_metrics(self):
+        return self.trajectory.metrics(self._index)
+
+    def targets(self):
+        targets = {}
+        for ans, a in self.answers.items():
+            ax, ay = a['location']
+            targets[ans] = (ax, ay + a['height'] // 2)
+        return targets
 
-    def _collect(self):
+    def _collect(self, q):
 
-        q = pump(True)
-        ui_request(queue=q)
         for e in q:
             if e.type == sdl2.SDL_MOUSEBUTTONDOWN:
                 coords = (e.button.x, e.button.y)
-                response = self.which_boundary(coords)
+                response = self._index.which(coords)
                 if response != None:
                     return response
         return None
 
 
+    @profiled('probe')
     def collect(self):
 
         show_mouse_cursor()
         response = None
-        onset = time.time()
+        onset = perf_counter_ns()
+        self.trajectory.start()
 
+        # Only redraw the probe when the highlighted answer changes (or the window does)
+        drawn = False
+        hover = self._index.which(mouse_pos())
         while response == None:
-            fill()
-            self._render()
-            flip()
-            response = self._collect()
+            q = pump(True)
+            event_log.record(q)
+            ui_request(queue=q)
+            self.trajectory.record(q)
+            redraw = not drawn or window_changed(q)
+            if needs_redraw(q):
+                new_hover = self._index.which(mouse_pos())
+                redraw = redraw or new_hover != hover
+                hover = new_hover
+            if redraw:
+                fill()
+                self._render(hover)
+                flip()
+                drawn = True
+            else:
+                time.sleep(0.001)
+            response = self._collect(q)
+
+        rt = (perf_counter_ns() - onset) / 1e9
+        hide_mouse_cursor()
+        return Response(response, rt)
+
+
+
+class LikertProbe(object):
+
+    def __init__(self, first, last, question, width, origin, labels=None):
+
+        self.q = question
+        self.width = width
+        self.origin = origin
+
+        height = width / (len(range(first, last+1)) + 2)
+        self.scale = LikertType(first, last, width, height, style='normal', labels=labels)
+        self.trajectory = MouseTrajectory()
+        self._static = None
+
+    def _static_layer(self):
+        # The question and numbers never change, so they're flattened into a single
+        # surface the first time they're drawn
+        if self._static is None:
+            self._static = flatten([(self.q, 8, self.origin)] + self.scale.static_items())
+        return self._static
+
+    def labels(self):
+        return dict(self.scale.numbers)
+
+    def trajectory_metrics(self):
+        return self.trajectory.metrics(self.scale._index)
+
+    def targets(self):
+        return self.scale.targets()
+
+    @profiled('probe')
+    def collect(self):
+
+        show_mouse_cursor()
+        onset = perf_counter_ns()
+        self.trajectory.start()
+
+        # Only redraw the probe when the highlighted number changes (or the window does)
+        drawn = False
+        hover = self.scale.hovered()
+        while self.scale.response == None:
+            q = pump(True)
+            event_log.record(q)
+            ui_request(queue=q)
+            self.trajectory.record(q)
+            redraw = not drawn or window_changed(q)
+            if needs_redraw(q):
+                new_hover = self.scale.hovered()
+                redraw = redraw or new_hover != hover
+                hover = new_hover
+            if redraw:
+                layer, corner = self._static_layer()
+                fill()
+                blit(layer, 7, corner)
+                self.scale.draw_overlay(hover)
+                flip()
+                drawn = True
+            else:
+                time.sleep(0.001)
+            self.scale.listen(q)
 
-        rt = time.time() - onset
+        response = self.scale.response
+        rt = (perf_counter_ns() - onset) / 1e9
         hide_mouse_cursor()
+        self.scale.response = None # reset for next time
         return Response(response, rt)
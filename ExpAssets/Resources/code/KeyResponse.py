@@ -0,0 +1,107 @@
+__author__ = "Austin Hurst"
+
+import time
+import math
+import sdl2
+
+from klibs.KLUserInterface import ui_request
+from klibs.KLUtilities import pump
+
+from EventLog import event_log
+
+
+class KeyResponse(object):
+    """A collector for a single keypress response following a stimulus.
+
+    Response times are taken from the timestamps SDL gives key events, measured from the
+    onset of the stimulus on the same (millisecond) clock, sampled right after the
+    stimulus is flipped to the screen (see :meth:`onset`). Note that SDL stamps events
+    when they are pumped from the OS into its queue, not when the key was pressed, so
+    a response can be timestamped late by up to the time since the previous check of the
+    queue. This is normally just the poll interval, but can be up to a refresh period if
+    a timed action (e.g. flipping a mask to the screen) blocked in between.
+
+    Timed actions during collection (e.g. drawing a mask) are given as a list of
+    (time, function) pairs, which are run once the queue has been checked for a response.
+
+    For every response, the time since the previous queue check is also recorded as its
+    input lag, i.e. the maximum amount by which its response time may be overestimated.
+
+    Args:
+        keys (dict): A dict mapping key names (e.g. ' ') to response labels (e.g. 'go').
+        poll_interval (float, optional): The time (in seconds) to sleep between checks of
+            the event queue, which sets the resolution of response times.
+
+    """
+    def __init__(self, keys, poll_interval=0.0005):
+        self.keys = {}
+        for key, label in keys.items():
+            if key == ' ':
+                keycode = sdl2.SDLK_SPACE
+            else:
+                keycode = sdl2.SDL_GetKeyFromName(key.encode('utf-8'))
+            self.keys[keycode] = label
+        self.poll_interval = poll_interval
+        self.lags = [] # in ms, the timing uncertainty of each response
+        self._onset_ticks = None
+
+    def onset(self):
+        """Marks the onset of the stimulus being responded to. Should be called immediately
+        after the stimulus is flipped to the screen.
+
+        """
+        self._onset_ticks = sdl2.SDL_GetTicks()
+
+    def collect(self, timeout, actions=[]):
+        """Waits for a response key to be pressed, or for a timeout (in ms) from the onset.
+
+        Returns:
+            tuple: The (label, rt, lag) of the response, with the response time and the
+            input lag (i.e. the maximum timing error of the response time) in ms. If no
+            response was made, returns (None, None, None).
+
+        """
+        if self._onset_ticks == None:
+            raise RuntimeError("onset() must be called before collecting a response.")
+        actions = sorted(actions, key=lambda a: a[0])
+        next_action = 0
+        last_polled = self._onset_ticks
+        try:
+            while True:
+                q = pump(True)
+                polled = sdl2.SDL_GetTicks()
+                event_log.record(q)
+                ui_request(queue=q)
+                for e in q:
+                    if e.type == sdl2.SDL_KEYDOWN and not e.key.repeat:
+                        # Ignore keys pressed before the stimulus was on screen
+                        if e.key.timestamp < self._onset_ticks:
+                            continue
+                        if e.key.keysym.sym in self.keys:
+                            rt = e.key.timestamp - self._onset_ticks
+                            # The key was pressed sometime since the last queue check
+                            lag = polled - last_polled
+                            self.lags.append(lag)
+                            return (self.keys[e.key.keysym.sym], rt, lag)
+                elapsed = polled - self._onset_ticks
+                while next_action < len(actions) and actions[next_action][0] <= elapsed:
+                    actions[next_action][1]()
+                    next_action += 1
+                if elapsed >= timeout:
+                    return (None, None, None)
+                last_polled = polled
+                time.sleep(self.poll_interval)
+        finally:
+            self._onset_ticks = None
+
+    def jitter(self):
+        """Returns the mean, standard deviation, and maximum input lag (in ms) across all
+        responses collected so far, or None if no responses have been collected.
+
+        """
+        n = len(self.lags)
+        if not n:
+            return None
+        mean = sum(self.lags) / float(n)
+        sd = math.sqrt(sum((lag - mean) ** 2 for lag in self.lags) / n)
+        return (mean, sd, max(self.lags))
@@ -0,0 +1,89 @@
+__author__ = "Austin Hurst"
+
+import numpy as np
+import sdl2
+
+from klibs.KLUtilities import mouse_pos
+
+
+class MouseTrajectory(object):
+    """Records the path of the mouse cursor from the onset of a response screen.
+
+    Samples are taken from the SDL mouse motion and click events in each event queue passed
+    to :meth:`record`, and are stored in a preallocated ring buffer so that recording never
+    allocates memory while a response is being collected. If a response takes more samples
+    than the buffer can hold, the earliest samples are overwritten.
+
+    Each sample is a (time, x, y) triplet, with time in milliseconds from the onset of
+    recording (using the SDL event timestamps).
+
+    Args:
+        capacity (int, optional): The maximum number of samples to keep per response.
+
+    """
+    def __init__(self, capacity=8192):
+        self.capacity = capacity
+        self._buf = np.zeros((capacity, 3), dtype=np.int32)
+        self._n = 0
+        self._onset = 0
+
+    def __len__(self):
+        return min(self._n, self.capacity)
+
+    def _add(self, t, x, y):
+        row = self._buf[self._n % self.capacity]
+        row[0], row[1], row[2] = t, x, y
+        self._n += 1
+
+    def start(self):
+        """Clears any previous samples and starts a new trajectory at the cursor's current
+        position.
+
+        """
+        self._n = 0
+        self._onset = sdl2.SDL_GetTicks()
+        x, y = mouse_pos()
+        self._add(0, x, y)
+
+    def record(self, queue):
+        """Adds a sample for every mouse motion or click event in an event queue.
+
+        """
+        for e in queue:
+            if e.type == sdl2.SDL_MOUSEMOTION:
+                self._add(e.motion.timestamp - self._onset, e.motion.x, e.motion.y)
+            elif e.type == sdl2.SDL_MOUSEBUTTONDOWN:
+                self._add(e.button.timestamp - self._onset, e.button.x, e.button.y)
+
+    def samples(self):
+        """Returns a copy of the recorded samples, in order, as an (n, 3) array of
+        (time, x, y) rows.
+
+        """
+        if self._n <= self.capacity:
+            return self._buf[:self._n].copy()
+        i = self._n % self.capacity
+        return np.concatenate([self._buf[i:], self._buf[:i]])
+
+    def metrics(self, index=None):
+        """Computes summary measures of the recorded trajectory.
+
+        Returns the path length (in px), the time of the first movement away from the
+        starting position (in ms, or None if the cursor never moved), and, if a hit-testing
+        index for the response screen is given, the number of times the cursor moved from
+        one answer to a different one.
+
+        """
+        s = self.samples()
+        t, x, y = s[:, 0], s[:, 1].astype(np.float64), s[:, 2].astype(np.float64)
+        moved = np.flatnonzero((x != x[0]) | (y != y[0])) if len(s) else []
+        out = {
+            'n_samples': len(s),
+            'path_length': float(np.hypot(np.diff(x), np.diff(y)).sum()),
+            'first_move_ms': int(t[moved[0]]) if len(moved) else None,
+        }
+        if index is not None:
+            hovered = index.which_all(x, y)
+            hovered = hovered[hovered >= 0]
+            out['answer_changes'] = int(np.count_nonzero(np.diff(hovered)))
+        return out
@@ -0,0 +1,163 @@
+__author__ = "Austin Hurst"
+
+import os
+import io
+import pstats
+import cProfile
+import functools
+from contextlib import contextmanager
+
+from klibs import P
+
+from FrameTiming import perf_counter_ns
+
+try:
+    from time import process_time as cpu_time
+except ImportError:
+    from time import clock as cpu_time # Python 2
+
+# Phases whose time is summarized by category in the profile report
+CATEGORIES = ['render', 'input', 'db']
+
+
+class PhaseProfiler(object):
+    """Cumulative wall-clock and CPU timers for the phases of a session.
+
+    Phases are timed with :meth:`phase` (or the :func:`profiled` decorator), and can be
+    nested: each timer is keyed by its full stack of phase names (e.g. 'trial;render'), so
+    time can be attributed both to a phase and to the phases it was called from. In addition,
+    every `sample_every`-th call of each phase is run under cProfile, so that time within
+    a phase can be broken down by function without profiling the whole session.
+
+    Profiling is disabled unless the 'profile_phases' param is True, in which case
+    :meth:`write` saves a text report, a collapsed-stack file for flame graph tools (e.g.
+    flamegraph.pl or speedscope), and the merged cProfile data.
+
+    Args:
+        sample_every (int, optional): How often to run a phase under cProfile.
+
+    """
+    def __init__(self, sample_every=50):
+        self.enabled = None # read from params on first use
+        self.sample_every = sample_every
+        self.wall = {}
+        self.cpu = {}
+        self.calls = {}
+        self._stack = []
+        self._profile = None
+        self._stats = None
+
+    def _is_enabled(self):
+        if self.enabled is None:
+            self.enabled = bool(getattr(P, 'profile_phases', False))
+        return self.enabled
+
+    @contextmanager
+    def phase(self, name):
+        """Times everything run within the ``with`` block as a phase with the given name.
+
+        """
+        if not self._is_enabled():
+            yield
+            return
+        self._stack.append(name)
+        key = ";".join(self._stack)
+        n = self.calls.get(key, 0)
+        self.calls[key] = n + 1
+        sampling = self._profile is None and n % self.sample_every == 0
+        if sampling:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        wall_start, cpu_start = perf_counter_ns(), cpu_time()
+        try:
+            yield
+        finally:
+            self.wall[key] = self.wall.get(key, 0) + perf_counter_ns() - wall_start
+            self.cpu[key] = self.cpu.get(key, 0) + cpu_time() - cpu_start
+            if sampling:
+                self._profile.disable()
+                if self._stats is None:
+                    self._stats = pstats.Stats(self._profile)
+                else:
+                    self._stats.add(self._profile)
+                self._profile = None
+            self._stack.pop()
+
+    def self_times(self):
+        """Returns the wall time (in ns) of each phase stack, minus the time spent in the
+        phases nested directly within it.
+
+        """
+        own = dict(self.wall)
+        for key, wall in self.wall.items():
+            parent = key.rpartition(";")[0]
+            if parent in own:
+                own[parent] -= wall
+        return own
+
+    def report(self):
+        """Returns a list of lines summarizing the time spent in each phase.
+
+        """
+        lines = ["{0:<40}{1:>8}{2:>12}{3:>12}{4:>12}{5:>12}".format(
+            "phase", "calls", "wall_ms", "mean_ms", "self_ms", "cpu_ms"
+        )]
+        own = self.self_times()
+        for key in sorted(self.wall.keys()):
+            wall_ms = self.wall[key] / 1e6
+            lines.append("{0:<40}{1:>8}{2:>12.1f}{3:>12.3f}{4:>12.1f}{5:>12.1f}".format(
+                key, self.calls[key], wall_ms, wall_ms / self.calls[key], own[key] / 1e6,
+                self.cpu[key] * 1000
+            ))
+
+        lines += ["", "time by category (ms):"]
+        for category in CATEGORIES:
+            total = sum(w for k, w in self.wall.items() if k.split(";")[-1] == category)
+            lines.append("{0:<12}{1:>12.1f}".format(category, total / 1e6))
+        return lines
+
+    def write(self, path):
+        """Writes the profile report (.txt), collapsed stacks (.folded), and sampled cProfile
+        data (.prof) to files with the given path (minus extension).
+
+        """
+        if not self._is_enabled():
+            return
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        lines = self.report()
+        if self._stats:
+            out = io.StringIO() if str is not bytes else io.BytesIO()
+            self._stats.stream = out
+            self._stats.sort_stats('cumulative').print_stats(30)
+            lines += ["", "sampled cProfile (every {0} calls per phase):".format(
+                self.sample_every
+            ), out.getvalue()]
+            self._stats.dump_stats(path + ".prof")
+        with open(path + ".txt", 'w') as f:
+            f.write("\n".join(lines) + "\n")
+
+        # Collapsed stacks of self time in microseconds, as used by flame graph tools
+        with open(path + ".folded", 'w') as f:
+            for key, ns in sorted(self.self_times().items()):
+                if ns > 0:
+                    f.write("{0} {1}\n".format(key, int(ns // 1000)))
+
+
+def profiled(name):
+    """A decorator that times each call of a function as a phase of the shared profiler.
+
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profiler.phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Shared profiler for all phases of the experiment
+profiler = PhaseProfiler()
@@ -0,0 +1,100 @@
+__author__ = "Austin Hurst"
+
+import io
+import json
+
+from klibs import P
+from klibs.KLCommunication import message
+from klibs.KLGraphics.KLNumpySurface import NumpySurface as NpS
+
+from InterfaceExtras import ThoughtProbe, LikertProbe
+
+PROBE_TYPES = ['choice', 'likert']
+
+
+class ProbeRegistry(object):
+    """The thought probe styles available to the experiment, loaded from a JSON config file.
+
+    Each entry in the file maps a probe name (e.g. 'mason2007') to its definition: its
+    type ('choice' for a list of answers, or 'likert' for a numbered scale), its question
+    text, its answers or scale range, and its width as a proportion of the screen.
+
+    Probes are only rendered when requested with :meth:`build`. If a cache is given, the
+    rendered question and answer text for each probe are saved to it, keyed by the probe's
+    definition and everything else that affects its rendering (font, text styles, and
+    screen resolution), so that later sessions on the same display skip text rendering.
+
+    Args:
+        path (str): The path of the probe config file.
+        cache (:obj:`ArrayCache`, optional): The on-disk cache to use for rendered probes.
+        styles (dict, optional): The names and sizes of the text styles used by the probes,
+            for keying the cache.
+
+    """
+    def __init__(self, path, cache=None, styles=None):
+        with io.open(path, encoding='utf-8') as f:
+            self.probes = json.load(f)
+        self.cache = cache
+        self.styles = styles if styles else {}
+
+        for name, probe in self.probes.items():
+            if probe.get('type') not in PROBE_TYPES:
+                e = "Probe '{0}' has an unknown type '{1}' (must be one of {2})."
+                raise ValueError(e.format(name, probe.get('type'), ", ".join(PROBE_TYPES)))
+
+    def __contains__(self, name):
+        return name in self.probes
+
+    def names(self):
+        return sorted(self.probes.keys())
+
+    def _cache_key(self, name):
+        return self.cache.key(
+            kind='probe_layout', probe=name, definition=self.probes[name], styles=self.styles,
+            font=P.default_font_name, color=P.default_color,
+            resolution=(P.screen_x, P.screen_y), ppd=P.ppd
+        )
+
+    def _answers(self, name):
+        probe = self.probes[name]
+        if probe['type'] == 'likert':
+            return list(range(probe['first'], probe['last'] + 1))
+        return [a for a, txt in probe['responses']]
+
+    def _create(self, name, question, labels=None):
+        probe = self.probes[name]
+        width = int(P.screen_x * probe['width'])
+        origin = (P.screen_c[0], P.screen_x//10)
+        if probe['type'] == 'likert':
+            return LikertProbe(probe['first'], probe['last'], question, width, origin, labels)
+        choices = dict((a, txt) for a, txt in probe['responses'])
+        order = self._answers(name)
+        return ThoughtProbe(choices, question, width, origin, order, labels)
+
+    def build(self, name):
+        """Creates the probe with the given name, loading its rendered text from the cache
+        if available.
+
+        """
+        if name not in self.probes:
+            raise ValueError("No probe named '{0}' in the probe config file.".format(name))
+        key = self._cache_key(name) if self.cache else None
+        cached = self.cache.load(key) if key else None
+
+        if cached:
+            question = NpS(cached['question'])
+            labels = {}
+            for i, a in enumerate(self._answers(name)):
+                labels[a] = NpS(cached['label_{0}'.format(i)])
+            return self._create(name, question, labels)
+
+        q = self.probes[name]['question']
+        question = message(q, "title", align='center', blit_txt=False)
+        probe = self._create(name, question)
+        if key:
+            labels = probe.labels()
+            arrays = {'question': question.render()}
+            for i, a in enumerate(self._answers(name)):
+                arrays['label_{0}'.format(i)] = labels[a].render()
+            self.cache.save(key, **arrays)
+        return probe
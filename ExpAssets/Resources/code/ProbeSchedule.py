@@ -0,0 +1,80 @@
+__author__ = "Austin Hurst"
+
+import random
+
+
+class ProbeSchedule(object):
+    """A precomputed schedule of which trials in a session are followed by thought probes.
+
+    The session is divided into repeating spans: a 'no-probe' span of `noprobe_span`
+    trials, followed by a 'probe' span of `probe_span` trials with a single probe placed
+    at a random position within it. This guarantees at least `noprobe_span` trials between
+    any two probes, while keeping probe onsets unpredictable.
+
+    The schedule is generated from its own random number generator, so the same seed
+    always produces the same schedule regardless of any other randomization done by the
+    experiment.
+
+    Args:
+        n_trials (int): The total number of (non-practice) trials in the session.
+        probe_span (int): The number of trials in each span containing a probe.
+        noprobe_span (int): The number of trials in each span without a probe.
+        trial_duration (float, optional): The minimum duration of a trial (in ms). Required
+            if `min_interval` is given.
+        min_interval (float, optional): The minimum time (in seconds) allowed between two
+            probes. Raises a ValueError if the given spans can't guarantee this interval.
+        seed (optional): The random seed to use for generating the schedule.
+
+    """
+    def __init__(self, n_trials, probe_span, noprobe_span, trial_duration=None,
+                 min_interval=None, seed=None):
+
+        if probe_span < 1:
+            raise ValueError("probe_span must be at least 1.")
+        if noprobe_span < 0:
+            raise ValueError("noprobe_span cannot be negative.")
+        if min_interval != None:
+            if trial_duration == None:
+                raise ValueError("trial_duration is required to enforce a min_interval.")
+            # The closest two probes can be is the last trial of one probe span and the
+            # first trial of the next probe span
+            closest = (noprobe_span + 1) * trial_duration / 1000.0
+            if closest < min_interval:
+                e = "Probes can be as close as {0:.1f} sec. apart, less than the minimum of {1}."
+                raise ValueError(e.format(closest, min_interval))
+
+        self.n_trials = n_trials
+        self.probe_span = probe_span
+        self.noprobe_span = noprobe_span
+        self.seed = seed
+
+        rand = random.Random("{0}-probes".format(seed)) if seed != None else random.Random()
+        schedule = []
+        while len(schedule) < n_trials:
+            span = [False] * probe_span
+            span[rand.randrange(probe_span)] = True
+            schedule += [False] * noprobe_span + span
+        self.schedule = tuple(schedule[:n_trials])
+        self.cursor = 0
+
+    def __len__(self):
+        return len(self.schedule)
+
+    def next(self):
+        """Returns whether the next trial in the session is a probe trial.
+
+        """
+        if self.cursor >= len(self.schedule):
+            raise IndexError("All {0} trials in the probe schedule have been used.".format(
+                len(self.schedule)
+            ))
+        probe = self.schedule[self.cursor]
+        self.cursor += 1
+        return probe
+
+    @property
+    def probe_trials(self):
+        """list: The indices of all probe trials in the session.
+
+        """
+        return [i for i, probe in enumerate(self.schedule) if probe]
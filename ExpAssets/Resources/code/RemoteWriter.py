@@ -0,0 +1,226 @@
+__author__ = "Austin Hurst"
+
+import os
+import io
+import json
+import glob
+import uuid
+import base64
+import socket
+import sqlite3
+import time
+
+from TrialWriter import TrialWriter
+from FrameTiming import perf_counter_ns
+
+
+class _CollectorBusy(Exception):
+    # The collector couldn't write a batch for now (e.g. its database was locked)
+    pass
+
+
+def _encode(value):
+    # Binary column values (e.g. probe trajectories) are sent to the collector as base64
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {'__bytes__': base64.b64encode(bytes(value)).decode('ascii')}
+    raise TypeError("{0!r} is not JSON serializable".format(value))
+
+
+class RemoteWriter(TrialWriter):
+    """Streams rows of trial data to a lab data collector (see tools/collector.py).
+
+    Works the same way as a :class:`TrialWriter`, except that the background thread sends
+    each batch of rows to the collector instead of writing them to a local database, and
+    waits for the collector to acknowledge it. If the collector can't be reached, batches
+    are kept in a spool file on disk and resent (in order) once it is back, so no data is
+    lost if a station goes offline mid-session. Spool files left over from earlier sessions
+    are resent (ahead of any new rows) the first time the writer sends a batch. Batches the
+    collector can't write for the moment (e.g. while its database is locked) are kept and
+    retried in the same way, but batches it rejects outright are moved to a '.rejected'
+    file in the spool folder and raise an error.
+
+    Since participant ids are only unique within each station's local database, the
+    participant's record (and their session info) needs to be sent with
+    :meth:`add_participant` before any rows for that participant, so the collector can
+    give the participant a new id. Each
+    station is identified by a random id stored in the spool folder, so the collector can
+    tell the participants of different stations (and sessions resumed later) apart.
+
+    Args:
+        address (str): The host and port of the collector (e.g. "127.0.0.1:5555").
+        table (str): The name of the table to insert rows into by default.
+        spool_dir (str): The folder in which to keep unsent batches.
+        maxsize (int, optional): The maximum number of rows to queue before :meth:`add`
+            blocks.
+        timeout (float, optional): The number of seconds to wait for the collector to
+            connect or acknowledge a batch before treating it as offline.
+        retries (int, optional): The number of times to retry a batch the collector
+            couldn't write before keeping it for later.
+
+    """
+    def __init__(self, address, table, spool_dir, maxsize=1000, timeout=5.0, retries=3):
+        host, port = address.rsplit(":", 1)
+        self.address = (host, int(port))
+        self.spool_dir = spool_dir
+        self.timeout = timeout
+        self.retries = retries
+        self.station = uuid.uuid4().hex # identifies this writer's batches
+        self.station_id = self._load_station_id()
+        self.spool_path = os.path.join(spool_dir, self.station + ".jsonl")
+        self.batch_num = 0
+        self.pending = self._load_spool() # batches not yet acknowledged
+        self.offline_batches = 0
+        self._reader = None
+        TrialWriter.__init__(self, None, table, maxsize)
+
+    def _load_station_id(self):
+        path = os.path.join(self.spool_dir, "station_id")
+        if not os.path.isfile(path):
+            if not os.path.isdir(self.spool_dir):
+                os.makedirs(self.spool_dir)
+            with io.open(path, 'w', encoding='utf-8') as f:
+                f.write(uuid.uuid4().hex)
+        with io.open(path, encoding='utf-8') as f:
+            return f.read().strip()
+
+    def _select(self, db_path, table, where, participant_id):
+        db = sqlite3.connect(db_path, timeout=30)
+        try:
+            q = "SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?"
+            if db.execute(q, [table]).fetchone() == None:
+                return []
+            q = "SELECT * FROM {0} WHERE {1} = ?".format(table, where)
+            cursor = db.execute(q, [participant_id])
+            cols = [d[0] for d in cursor.description]
+            return [dict(zip(cols, row)) for row in cursor.fetchall()]
+        finally:
+            db.close()
+
+    def add_participant(self, db_path, participant_id):
+        """Queues a participant's record, along with any session info klibs stored for them,
+        from a local database to be sent to the collector.
+
+        Args:
+            db_path (str): The path of the local database the participant was added to.
+            participant_id (int): The participant's id in the local database.
+
+        """
+        rows = self._select(db_path, 'participants', 'id', participant_id)
+        if not len(rows):
+            e = "No participant with id {0} in '{1}'.".format(participant_id, db_path)
+            raise ValueError(e)
+        self.add(rows[0], table='participants')
+        self.update_session_info(db_path, participant_id)
+
+    def update_session_info(self, db_path, participant_id, **values):
+        """Queues a participant's session info from a local database to be sent to the
+        collector, replacing any session info sent for them before.
+
+        Args:
+            db_path (str): The path of the local database the participant was added to.
+            participant_id (int): The participant's id in the local database.
+            **values: Columns to change before sending (e.g. complete=True at the end of
+                a session, since klibs only updates its own record after the session).
+
+        """
+        for row in self._select(db_path, 'session_info', 'participant_id', participant_id):
+            row.pop('id', None)
+            row.update((col, val) for col, val in values.items() if col in row)
+            self.add(row, table='session_info')
+
+    def _load_spool(self):
+        pending = []
+        for path in sorted(glob.glob(os.path.join(self.spool_dir, "*.jsonl"))):
+            with io.open(path, encoding='utf-8') as f:
+                pending += [(path, line.strip()) for line in f if line.strip()]
+        return pending
+
+    def _save_spool(self):
+        # Rewrite every spool file that still has unsent batches, and remove the rest
+        files = {}
+        for path, msg in self.pending:
+            files.setdefault(path, []).append(msg)
+        for path in set(p for p in glob.glob(os.path.join(self.spool_dir, "*.jsonl"))):
+            if path not in files:
+                os.remove(path)
+        if len(files) and not os.path.isdir(self.spool_dir):
+            os.makedirs(self.spool_dir)
+        for path, msgs in files.items():
+            tmp = path + ".tmp"
+            with io.open(tmp, 'w', encoding='utf-8') as f:
+                f.write(u"\n".join(msgs) + u"\n")
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp, path)
+
+    def _connect(self):
+        sock = socket.create_connection(self.address, timeout=self.timeout)
+        self._reader = sock.makefile('rb')
+        return sock
+
+    def _disconnect(self):
+        for s in [self._reader, self._db]:
+            if s:
+                try:
+                    s.close()
+                except socket.error:
+                    pass
+        self._reader, self._db = None, None
+
+    def _reject(self, path, msg):
+        # Keep batches the collector won't ever accept, so their data can be recovered
+        with io.open(os.path.splitext(path)[0] + ".rejected", 'a', encoding='utf-8') as f:
+            f.write(msg + u"\n")
+
+    def _send(self, msg):
+        # Sends a batch, retrying with a short backoff if the collector can't write it yet
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                time.sleep(0.25 * 2 ** attempt)
+            self._db.sendall((msg + u"\n").encode('utf-8'))
+            reply = json.loads(self._reader.readline().decode('utf-8'))
+            if not reply.get('retry'):
+                return reply
+        raise _CollectorBusy(reply['error'])
+
+    def _send_pending(self):
+        while len(self.pending):
+            path, msg = self.pending[0]
+            reply = self._send(msg)
+            self.pending.pop(0)
+            if 'error' in reply:
+                self._reject(path, msg)
+                raise RuntimeError("Collector rejected batch: {0}".format(reply['error']))
+            self.rows_written += len(json.loads(msg)['rows'])
+
+    def _write(self, batch):
+        start = perf_counter_ns()
+        self.batch_num += 1
+        msg = {
+            'station': self.station, 'station_id': self.station_id,
+            'batch': self.batch_num, 'rows': batch
+        }
+        msg = json.dumps(msg, default=_encode)
+        self.pending.append((self.spool_path, msg))
+        spooled = len(self.pending) > 1
+
+        try:
+            if not self._db:
+                self._db = self._connect()
+            self._send_pending()
+        except (socket.error, ValueError, _CollectorBusy):
+            # Collector unreachable, connection dropped, or the collector can't write
+            # batches right now, so keep them until it's back
+            self._disconnect()
+            self.offline_batches += 1
+            spooled = True
+        finally:
+            if spooled:
+                self._save_spool()
+        self.flush_times.append(perf_counter_ns() - start)
+
+    def stats(self):
+        stats = TrialWriter.stats(self)
+        stats['offline_batches'] = self.offline_batches
+        stats['unsent_batches'] = len(self.pending)
+        return stats
@@ -0,0 +1,119 @@
+__author__ = "Austin Hurst"
+
+import os
+import io
+import json
+import glob
+import time
+import sqlite3
+
+
+class SessionCheckpoint(object):
+    """An append-only log of session state, for resuming sessions after a crash.
+
+    Each session gets its own checkpoint file, starting with a header record of the
+    session's participant id, condition, and random seed. A small record is then appended
+    at the start of every block with the block number, the position in the probe schedule,
+    and the state of the random number generator. Each record is flushed to disk as soon
+    as it is written, and a partially-written last record (e.g. from a crash or power
+    loss mid-write) is ignored when reading the file back.
+
+    Args:
+        path (str): The folder in which to keep checkpoint files.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def _append(self, record):
+        with io.open(self.file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + u"\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _read(self, path):
+        records = []
+        with io.open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break # truncated record at the end of the file
+        return records
+
+    def start(self, participant_id, condition, random_seed):
+        """Starts a checkpoint file for a new session.
+
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        fname = "session_{0}_{1}.jsonl".format(participant_id, int(time.time()))
+        self.file = os.path.join(self.path, fname)
+        self._append({
+            'participant_id': participant_id, 'condition': condition,
+            'random_seed': random_seed
+        })
+
+    def save(self, block, probe_cursor, random_state):
+        """Records the state of the session at the start of a block.
+
+        """
+        self._append({'block': block, 'probe_cursor': probe_cursor, 'random_state': random_state})
+
+    def finish(self):
+        """Marks the current session as complete, so it will never be resumed.
+
+        """
+        if self.file:
+            self._append({'complete': True})
+
+    def resume(self):
+        """Finds the most recent incomplete session and continues its checkpoint file.
+
+        Returns:
+            dict: The session's header record, updated with its most recent block
+            record, or None if there is no session to resume.
+
+        """
+        files = glob.glob(os.path.join(self.path, "session_*.jsonl"))
+        for path in sorted(files, key=os.path.getmtime, reverse=True):
+            records = self._read(path)
+            if len(records) < 2 or records[-1].get('complete'):
+                continue
+            # Drop any truncated record, so that new records aren't appended onto it
+            tmp = path + ".tmp"
+            with io.open(tmp, 'w', encoding='utf-8') as f:
+                f.write(u"".join(json.dumps(r) + u"\n" for r in records))
+            os.remove(path)
+            os.rename(tmp, path)
+
+            state = dict(records[0])
+            state.update(records[-1])
+            state['random_state'] = _to_state(state['random_state'])
+            self.file = path
+            return state
+        return None
+
+
+def _to_state(state):
+    # JSON turns the tuples in a random.getstate() state into lists, so turn them back
+    return tuple(tuple(s) if isinstance(s, list) else s for s in state)
+
+
+def remove_participant(db_path, participant_id):
+    """Deletes a participant's record (and any session info klibs stored for them) from
+    a database, e.g. the record klibs creates at launch for a session that is resumed
+    under its original participant id instead.
+
+    """
+    db = sqlite3.connect(db_path, timeout=30)
+    try:
+        with db:
+            q = "SELECT name FROM sqlite_master WHERE type = 'table'"
+            if 'session_info' in [r[0] for r in db.execute(q)]:
+                q = "DELETE FROM session_info WHERE participant_id = ?"
+                db.execute(q, [participant_id])
+            db.execute("DELETE FROM participants WHERE id = ?", [participant_id])
+    finally:
+        db.close()
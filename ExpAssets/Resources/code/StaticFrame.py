@@ -0,0 +1,109 @@
+__author__ = "Austin Hurst"
+
+import time
+import sdl2
+
+from klibs.KLGraphics import fill, flip
+from klibs.KLUserInterface import ui_request, key_pressed
+from klibs.KLUtilities import pump
+from klibs.KLTime import CountDown
+
+from EventLog import event_log
+
+# SDL events that can change what an interactive screen should look like
+REDRAW_EVENTS = [
+    sdl2.SDL_MOUSEMOTION, sdl2.SDL_MOUSEBUTTONDOWN, sdl2.SDL_MOUSEBUTTONUP,
+    sdl2.SDL_WINDOWEVENT
+]
+
+
+def needs_redraw(queue):
+    """Checks whether an event queue contains any input that could change a screen.
+
+    """
+    for e in queue:
+        if e.type in REDRAW_EVENTS:
+            return True
+    return False
+
+
+def window_changed(queue):
+    """Checks whether an event queue contains any window events (e.g. the window being
+    exposed or restored), after which the screen's contents need to be redrawn.
+
+    """
+    for e in queue:
+        if e.type == sdl2.SDL_WINDOWEVENT:
+            return True
+    return False
+
+
+class StaticFrame(object):
+    """A screen that is drawn once and then held until a deadline, condition, or keypress.
+
+    Instead of redrawing the same frame as fast as possible, the frame is only flipped to
+    the screen when it is first presented. While it is held, the event queue is checked
+    for quit/pause requests every `poll_interval` seconds and the process sleeps in
+    between, keeping CPU usage low without affecting deadline precision by more than the
+    poll interval.
+
+    For benchmarking, setting the class attribute `redraw_while_held` to True makes held
+    frames redraw continuously instead (as every screen of the task used to), so the CPU
+    usage of the two approaches can be compared. Similarly, all hold durations are
+    multiplied by the class attribute `time_scale`, for running the task faster than
+    real time.
+
+    Args:
+        draw (callable): A function that blits the contents of the frame to the screen.
+        poll_interval (float, optional): The maximum time (in seconds) to sleep between
+            event queue checks while the frame is being held.
+        flip (callable, optional): The function to use for flipping the frame to the
+            screen, e.g. :meth:`FrameTiming.FrameTimer.flip`. Defaults to klibs' flip().
+
+    """
+    redraw_while_held = False
+    time_scale = 1.0 # multiplies all hold durations, for running the task faster
+
+    def __init__(self, draw, poll_interval=0.001, flip=flip):
+        self.draw = draw
+        self.poll_interval = poll_interval
+        self.flip = flip
+
+    def show(self):
+        fill()
+        self.draw()
+        self.flip()
+
+    def hold(self, duration=None, until=None, key=None):
+        """Shows the frame, then waits until a given duration (in seconds) has elapsed,
+        a given function returns True, or a given key has been pressed (whichever comes
+        first).
+
+        Returns:
+            bool: True if the hold ended because of the given key, otherwise False.
+
+        """
+        self.show()
+        timer = CountDown(duration * self.time_scale) if duration != None else None
+        while True:
+            q = pump(True)
+            event_log.record(q)
+            ui_request(queue=q)
+            if key != None and key_pressed(key, queue=q):
+                return True
+            if until != None and until():
+                return False
+            if self.redraw_while_held:
+                # Plain flips, so any timestamped flip function only marks the onset
+                fill()
+                self.draw()
+                flip()
+                if timer != None and timer.remaining() <= 0:
+                    return False
+            elif timer != None:
+                remaining = timer.remaining()
+                if remaining <= 0:
+                    return False
+                time.sleep(min(remaining, self.poll_interval))
+            else:
+                time.sleep(self.poll_interval)
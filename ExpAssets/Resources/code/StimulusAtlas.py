@@ -0,0 +1,263 @@
+__author__ = "Austin Hurst"
+
+import os
+import io
+import json
+import hashlib
+
+import numpy as np
+from OpenGL import GL as gl
+
+from klibs import P
+from klibs.KLCommunication import message
+
+try:
+    _replace = os.replace
+except AttributeError:
+    _replace = os.rename # Python 2 (atomic on POSIX, but can't overwrite on Windows)
+
+
+def _top_left(w, h, registration, location):
+    # Converts a klibs-style registration and location into a top-left corner
+    x, y = location
+    if registration in [7, 4, 1]:
+        left = x
+    elif registration in [9, 6, 3]:
+        left = x - w
+    else:
+        left = x - w // 2
+    if registration in [7, 8, 9]:
+        top = y
+    elif registration in [1, 2, 3]:
+        top = y - h
+    else:
+        top = y - h // 2
+    return (int(left), int(top))
+
+
+def _over(out, surf, x, y):
+    # Alpha-composites an RGBA uint8 surface onto a float RGBA canvas at (x, y)
+    sh, sw = surf.shape[0:2]
+    src = surf.astype(np.float64) / 255.0
+    dst = out[y:y+sh, x:x+sw]
+    src_a = src[:, :, 3:4]
+    dst_a = dst[:, :, 3:4]
+    out_a = src_a + dst_a * (1 - src_a)
+    rgb = src[:, :, 0:3] * src_a + dst[:, :, 0:3] * dst_a * (1 - src_a)
+    rgb = np.divide(rgb, out_a, out=np.zeros_like(rgb), where=out_a > 0)
+    out[y:y+sh, x:x+sw] = np.concatenate([rgb, out_a], axis=2)
+
+
+def composite(base, overlay):
+    """Alpha-composites one RGBA surface over the middle of another.
+
+    Both surfaces must be RGBA numpy arrays (e.g. the output of a KLDraw shape's ``render()``
+    method). The returned surface is large enough to contain both inputs, so the result
+    can be blitted in place of the two originals with the same registration and location.
+
+    """
+    h = max(base.shape[0], overlay.shape[0])
+    w = max(base.shape[1], overlay.shape[1])
+    out = np.zeros((h, w, 4), dtype=np.float64)
+
+    for surf in [base, overlay]:
+        sh, sw = surf.shape[0:2]
+        _over(out, surf, (w - sw) // 2, (h - sh) // 2)
+
+    return np.round(out * 255).astype(np.uint8)
+
+
+def flatten(items):
+    """Alpha-composites a list of surfaces into a single surface, as if each had been
+    blitted to the screen in order.
+
+    Each item is a (surface, registration, location) tuple, using the same registration
+    and location conventions as klibs' blit(). Surfaces can be numpy arrays or anything
+    with a ``render()`` method returning one (e.g. rendered text).
+
+    Returns:
+        tuple: The flattened RGBA surface and the screen location of its top-left corner,
+        for blitting with registration 7.
+
+    """
+    placed = []
+    for surf, reg, loc in items:
+        arr = surf.render() if hasattr(surf, 'render') else surf
+        left, top = _top_left(arr.shape[1], arr.shape[0], reg, loc)
+        placed.append((arr, left, top))
+
+    x0 = min(left for arr, left, top in placed)
+    y0 = min(top for arr, left, top in placed)
+    x1 = max(left + arr.shape[1] for arr, left, top in placed)
+    y1 = max(top + arr.shape[0] for arr, left, top in placed)
+    out = np.zeros((y1 - y0, x1 - x0, 4), dtype=np.float64)
+    for arr, left, top in placed:
+        _over(out, arr, left - x0, top - y0)
+
+    return np.round(out * 255).astype(np.uint8), (x0, y0)
+
+
+
+class ArrayCache(object):
+    """An on-disk cache of rendered surfaces, stored as .npz files.
+
+    Entries are keyed by a hash of everything that affects how they render (e.g. font,
+    font size, and screen resolution), so stale entries are never loaded after the
+    experiment's display or text settings change.
+
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def key(self, **fields):
+        blob = json.dumps(fields, sort_keys=True, default=str).encode('utf-8')
+        return hashlib.sha1(blob).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + ".npz")
+
+    def load(self, key):
+        f = self._file(key)
+        if not os.path.exists(f):
+            return None
+        try:
+            with np.load(f) as data:
+                return dict(data)
+        except (IOError, ValueError):
+            return None # ignore corrupt or truncated cache files
+
+    def save(self, key, **arrays):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        # Write to a temporary file first and swap it in atomically, so a crash never
+        # leaves a partial entry and stations sharing the cache never see a missing one
+        tmp = "{0}.{1}.tmp".format(self._file(key), os.getpid())
+        with io.open(tmp, 'wb') as f:
+            np.savez(f, **arrays)
+        _replace(tmp, self._file(key))
+
+
+
+class DigitAtlas(object):
+    """A single texture atlas containing every digit in every font size used by the task.
+
+    The atlas is built lazily on first use, and is loaded from an on-disk cache if a
+    matching one exists. Each size gets its own row of the atlas. Digits are drawn with
+    :meth:`blit`, which uploads the atlas to the GPU once and then draws each digit as a
+    sub-rect of that texture, so no pixel data is copied or uploaded per frame. Views of
+    individual digits can also be retrieved with :meth:`get`.
+
+    """
+    def __init__(self, digits, sizes, cache=None):
+        self.digits = list(digits)
+        self.sizes = list(sizes)
+        self.cache = cache
+        self.atlas = None
+        self.rects = None
+        self.texture = None
+
+    def _cache_key(self):
+        return self.cache.key(
+            kind='digit_atlas', digits=self.digits, sizes=self.sizes,
+            font=P.default_font_name, color=P.default_color,
+            resolution=(P.screen_x, P.screen_y), ppd=P.ppd
+        )
+
+    def _render(self):
+        rendered = []
+        for size in self.sizes:
+            row = [message(str(d), style=size, blit_txt=False).render() for d in self.digits]
+            rendered.append(row)
+
+        row_heights = [max(s.shape[0] for s in row) for row in rendered]
+        row_widths = [sum(s.shape[1] for s in row) for row in rendered]
+        atlas = np.zeros((sum(row_heights), max(row_widths), 4), dtype=np.uint8)
+        rects = np.zeros((len(self.sizes), len(self.digits), 4), dtype=np.int32)
+
+        y = 0
+        for i, row in enumerate(rendered):
+            x = 0
+            for j, surf in enumerate(row):
+                h, w = surf.shape[0:2]
+                atlas[y:y+h, x:x+w] = surf
+                rects[i, j] = (x, y, w, h)
+                x += w
+            y += row_heights[i]
+
+        return atlas, rects
+
+    def build(self):
+        """Builds (or loads from cache) the atlas, if not built already.
+
+        """
+        if self.atlas is not None:
+            return
+        key = self._cache_key() if self.cache else None
+        cached = self.cache.load(key) if key else None
+        if cached:
+            self.atlas, self.rects = cached['atlas'], cached['rects']
+        else:
+            self.atlas, self.rects = self._render()
+            if key:
+                self.cache.save(key, atlas=self.atlas, rects=self.rects)
+
+    def rect(self, digit, size):
+        """Returns the (x, y, width, height) sub-rect of a digit/size within the atlas.
+
+        """
+        self.build()
+        x, y, w, h = self.rects[self.sizes.index(size), self.digits.index(digit)]
+        return (int(x), int(y), int(w), int(h))
+
+    def get(self, digit, size):
+        """Returns a view of a given digit at a given size within the atlas.
+
+        """
+        x, y, w, h = self.rect(digit, size)
+        return self.atlas[y:y+h, x:x+w]
+
+    def upload(self):
+        """Uploads the atlas to an OpenGL texture, if not uploaded already. Requires the
+        klibs display to have been opened.
+
+        """
+        self.build()
+        if self.texture is not None:
+            return
+        h, w = self.atlas.shape[0:2]
+        self.texture = gl.glGenTextures(1)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_NEAREST)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
+        gl.glTexImage2D(
+            gl.GL_TEXTURE_2D, 0, gl.GL_RGBA, w, h, 0, gl.GL_RGBA, gl.GL_UNSIGNED_BYTE,
+            np.ascontiguousarray(self.atlas)
+        )
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+
+    def blit(self, digit, size, registration=7, location=(0, 0)):
+        """Draws a given digit at a given size to the screen straight from the atlas
+        texture, using the same registration and location conventions as klibs' blit().
+
+        """
+        self.upload()
+        x, y, w, h = self.rect(digit, size)
+        ah, aw = self.atlas.shape[0:2]
+        u0, v0, u1, v1 = x / float(aw), y / float(ah), (x + w) / float(aw), (y + h) / float(ah)
+        left, top = _top_left(w, h, registration, location)
+
+        gl.glEnable(gl.GL_TEXTURE_2D)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+        gl.glTexEnvi(gl.GL_TEXTURE_ENV, gl.GL_TEXTURE_ENV_MODE, gl.GL_REPLACE)
+        gl.glBegin(gl.GL_QUADS)
+        gl.glTexCoord2f(u0, v0)
+        gl.glVertex2f(left, top)
+        gl.glTexCoord2f(u1, v0)
+        gl.glVertex2f(left + w, top)
+        gl.glTexCoord2f(u1, v1)
+        gl.glVertex2f(left + w, top + h)
+        gl.glTexCoord2f(u0, v1)
+        gl.glVertex2f(left, top + h)
+        gl.glEnd()
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+        gl.glDisable(gl.GL_TEXTURE_2D)
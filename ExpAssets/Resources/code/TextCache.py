@@ -0,0 +1,56 @@
+__author__ = "Austin Hurst"
+
+from collections import OrderedDict
+
+from klibs.KLCommunication import message
+
+
+class TextCache(object):
+    """A bounded, least-recently-used cache of rendered text surfaces.
+
+    Rendered messages are keyed by their text, style, alignment, and wrap width, so a
+    message that is shown repeatedly (e.g. feedback or prompts shown every few trials)
+    is only ever rendered once. When the cache is full, the least recently used message
+    is dropped to make room for new ones.
+
+    Args:
+        maxsize (int, optional): The maximum number of rendered messages to keep.
+
+    """
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def render(self, text, style=None, align='left', wrap_width=None):
+        """Returns a rendered surface for a message, rendering it if not already cached.
+
+        Takes the same text, style, align, and wrap_width arguments as klibs' message().
+
+        """
+        key = (text, style, align, wrap_width)
+        if key in self._cache:
+            surf = self._cache.pop(key) # re-inserted below as most recently used
+        else:
+            surf = message(text, style, align=align, wrap_width=wrap_width, blit_txt=False)
+            if len(self._cache) >= self.maxsize:
+                self._cache.popitem(last=False)
+        self._cache[key] = surf
+        return surf
+
+    def warm(self, messages):
+        """Pre-renders a list of messages, each given as a dict of arguments to
+        :meth:`render` (e.g. ``{'text': "Correct!", 'style': 'normal'}``).
+
+        """
+        for msg in messages:
+            self.render(**msg)
+
+    def clear(self):
+        self._cache = OrderedDict()
+
+
+# Shared cache for all text rendered by the experiment
+text_cache = TextCache()
@@ -0,0 +1,142 @@
+__author__ = "Austin Hurst"
+
+import zlib
+
+import numpy as np
+
+
+def _no_runs(eq, n):
+    """Checks, along the last axis of a boolean array, that there are no runs of `n` or
+    more consecutive True values.
+
+    """
+    c = np.cumsum(eq, axis=-1)
+    c = np.concatenate([np.zeros(c.shape[:-1] + (1,), dtype=c.dtype), c], axis=-1)
+    return ~np.any(c[..., n:] - c[..., :-n] >= n, axis=-1)
+
+
+def _shuffled(pool, shape, length, rng):
+    """Returns an array of shape (*shape, length) where each row is the first `length`
+    items of an independent random permutation of `pool`.
+
+    """
+    order = np.argsort(rng.random_sample(shape + (len(pool),)), axis=-1)[..., :length]
+    return pool[order]
+
+
+class TrialSequence(object):
+    """A precomputed sequence of the digit and digit size for every trial of a session.
+
+    Every block contains each digit and each size equally often (within one trial, if the
+    block length isn't a multiple of the number of digits or sizes). Across and within
+    blocks, the sequence is constrained so that the same digit or size is never repeated
+    more than a given number of trials in a row, and so that targets are always a minimum
+    number of trials apart.
+
+    To find a sequence that is also well balanced across the whole session, many candidate
+    sequences are generated at once. Each block is drawn for every candidate in parallel:
+    of several random orders, the one that satisfies the constraints (given the end of the
+    previous block) and uses the least-used digit x size combinations so far is chosen.
+    The candidate whose digit x size combinations are closest to being equally frequent
+    is kept.
+
+    The sequence is generated from its own random number generator, so the same seed always
+    produces the same sequence.
+
+    Args:
+        n_blocks (int): The number of blocks in the session (including practice blocks).
+        block_len (int): The number of trials in each block.
+        digits (list): The digits to present.
+        n_sizes (int): The number of digit sizes to present.
+        target (int): The target digit.
+        max_digit_run (int, optional): The maximum number of times in a row the same digit
+            can be presented.
+        max_size_run (int, optional): The maximum number of times in a row the same size
+            can be presented.
+        min_target_gap (int, optional): The minimum number of trials from one target to
+            the next.
+        candidates (int, optional): The number of candidate sequences to generate.
+        options (int, optional): The number of random orders to try for each block of each
+            candidate before giving up on that candidate.
+        seed (optional): The random seed to use for generating the sequence.
+
+    """
+    def __init__(self, n_blocks, block_len, digits, n_sizes, target, max_digit_run=1,
+                 max_size_run=2, min_target_gap=4, candidates=200, options=32, seed=None):
+
+        self.n_blocks = n_blocks
+        self.block_len = block_len
+        self.max_digit_run = max_digit_run
+        self.max_size_run = max_size_run
+        self.min_target_gap = min_target_gap
+
+        if seed != None:
+            seed = zlib.crc32("{0}-sequence".format(seed).encode('utf-8')) & 0xffffffff
+        rng = np.random.RandomState(seed)
+
+        digits = np.asarray(digits)
+        digit_pool = np.tile(digits, -(-block_len // len(digits)))
+        size_pool = np.tile(np.arange(n_sizes), -(-block_len // n_sizes))
+        lookup = np.zeros(digits.max() + 1, dtype=np.int64)
+        lookup[digits] = np.arange(len(digits))
+
+        # Each candidate's last few trials, with unique placeholders before the first block
+        tail = max(max_digit_run, max_size_run, min_target_gap - 1, 1)
+        tail_d = np.tile(-np.arange(1, tail + 1), (candidates, 1))
+        tail_s = tail_d.copy()
+
+        out_d = np.zeros((candidates, n_blocks, block_len), dtype=np.int64)
+        out_s = np.zeros((candidates, n_blocks, block_len), dtype=np.int64)
+        counts = np.zeros((candidates, len(digits), n_sizes), dtype=np.int64)
+        ok = np.ones(candidates, dtype=bool)
+        rows = np.arange(candidates)
+
+        for b in range(n_blocks):
+            d = _shuffled(digit_pool, (candidates, options), block_len, rng)
+            s = _shuffled(size_pool, (candidates, options), block_len, rng)
+            d = np.concatenate([np.repeat(tail_d[:, None], options, axis=1), d], axis=-1)
+            s = np.concatenate([np.repeat(tail_s[:, None], options, axis=1), s], axis=-1)
+
+            valid = _no_runs(d[..., 1:] == d[..., :-1], max_digit_run)
+            valid &= _no_runs(s[..., 1:] == s[..., :-1], max_size_run)
+            if min_target_gap > 1:
+                # No two targets within any span of min_target_gap trials
+                t = np.cumsum(d == target, axis=-1)
+                t = np.concatenate([np.zeros(t.shape[:-1] + (1,), dtype=t.dtype), t], axis=-1)
+                spans = t[..., min_target_gap:] - t[..., :-min_target_gap]
+                valid &= ~np.any(spans > 1, axis=-1)
+
+            # Of the valid orders, pick the one whose digit x size combinations have been
+            # used least so far in the candidate's sequence
+            new_d, new_s = lookup[d[..., tail:]], s[..., tail:]
+            used = counts[rows[:, None, None], new_d, new_s].sum(axis=-1)
+            pick = np.argmin(np.where(valid, used, np.iinfo(used.dtype).max), axis=1)
+            ok &= valid[rows, pick]
+            np.add.at(counts, (rows[:, None], new_d[rows, pick], new_s[rows, pick]), 1)
+
+            d, s = d[rows, pick], s[rows, pick]
+            out_d[:, b], out_s[:, b] = d[:, tail:], s[:, tail:]
+            tail_d, tail_s = d[:, -tail:], s[:, -tail:]
+
+        if not np.any(ok):
+            raise ValueError(
+                "Could not generate a trial sequence meeting the given constraints. Try "
+                "relaxing max_digit_run, max_size_run, or min_target_gap."
+            )
+
+        # Score each candidate by how unevenly digit x size combinations occur
+        deviation = counts - counts.mean(axis=2, keepdims=True)
+        scores = np.where(ok, (deviation ** 2).sum(axis=(1, 2)), np.inf)
+
+        best = int(np.argmin(scores))
+        self.digits = out_d[best]
+        self.sizes = out_s[best]
+        self.score = float(scores[best])
+        self.valid_candidates = int(ok.sum())
+
+    def trial(self, block, trial):
+        """Returns the (digit, size index) for a given trial of a given block, both
+        numbered starting from 1.
+
+        """
+        return (int(self.digits[block - 1, trial - 1]), int(self.sizes[block - 1, trial - 1]))
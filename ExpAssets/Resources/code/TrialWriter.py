@@ -0,0 +1,179 @@
+__author__ = "Austin Hurst"
+
+import time
+import sqlite3
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue # Python 2
+
+from FrameTiming import perf_counter_ns
+
+_STOP = object() # sentinel telling the writer thread to exit
+
+
+def to_sql(value):
+    """Converts a trial data value to its typed SQLite representation.
+
+    'NA' placeholders become NULL and booleans become integers, so that numeric columns
+    can be stored (and exported) as real numbers instead of strings.
+
+    """
+    if value is None or value == 'NA':
+        return None
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+class TrialWriter(object):
+    """Writes rows of trial data to the database from a background thread.
+
+    Rows are put on a bounded queue with :meth:`add`, which only blocks if the queue is
+    full. A worker thread owns the database connection and writes rows as they arrive,
+    inserting everything waiting in the queue in a single transaction, so a slow disk or a
+    database locked by another station never lengthens the time between trials. The
+    database is opened in write-ahead logging (WAL) mode, so a crash mid-session can lose
+    at most the queued rows and never corrupts the rows already written.
+
+    Errors raised by the worker thread are re-raised on the next call to :meth:`add`,
+    :meth:`flush`, or :meth:`close`.
+
+    Args:
+        db_path (str): The path of the SQLite database to write to.
+        table (str): The name of the table to insert rows into by default.
+        maxsize (int, optional): The maximum number of rows to queue before :meth:`add`
+            blocks.
+
+    """
+    def __init__(self, db_path, table, maxsize=1000):
+        self.db_path = db_path
+        self.table = table
+        self.flush_times = [] # in ns, for benchmarking
+        self.queue_depths = [] # queued rows at each add, for benchmarking
+        self.wait_times = [] # in ns, time spent blocked on a full queue
+        self.rows_written = 0
+        self._queue = queue.Queue(maxsize)
+        self._error = None
+        self._db = None # only ever used by the writer thread
+        self._thread = threading.Thread(target=self._run, name="TrialWriter")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def _write(self, batch):
+        start = perf_counter_ns()
+        if not self._db:
+            self._db = self._connect()
+
+        # Group rows by table and column set so each group can be inserted in one go
+        groups = {}
+        for table, row in batch:
+            cols = tuple(sorted(row.keys()))
+            groups.setdefault((table, cols), []).append(tuple(row[c] for c in cols))
+
+        with self._db:
+            for (table, cols), values in groups.items():
+                q = "INSERT INTO {0} ({1}) VALUES ({2})".format(
+                    table, ", ".join(cols), ", ".join(["?"] * len(cols))
+                )
+                self._db.executemany(q, values)
+        self.rows_written += len(batch)
+        self.flush_times.append(perf_counter_ns() - start)
+
+    def _run(self):
+        stop = False
+        while not stop:
+            # Wait for a row, then take everything else already waiting in the same batch
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            rows = [item for item in batch if item is not _STOP]
+            stop = len(rows) < len(batch)
+            try:
+                if len(rows):
+                    self._write(rows)
+            except Exception as e:
+                self._error = e
+            finally:
+                for i in range(len(batch)):
+                    self._queue.task_done()
+        if self._db:
+            self._db.close()
+            self._db = None
+
+    def _check(self):
+        if self._error:
+            e, self._error = self._error, None
+            raise e
+
+    def add(self, row, table=None):
+        """Queues a row (a dict of column names and values) to be written to the database.
+
+        Rows are written to the writer's default table, unless another table is given.
+
+        """
+        self._check()
+        if not self._thread.is_alive():
+            raise RuntimeError("Cannot add rows to a closed TrialWriter.")
+        row = dict((col, to_sql(val)) for col, val in row.items())
+        self.queue_depths.append(self._queue.qsize())
+        start = perf_counter_ns()
+        self._queue.put((table if table else self.table, row))
+        self.wait_times.append(perf_counter_ns() - start)
+
+    def flush(self, timeout=None):
+        """Blocks until all queued rows have been written to the database.
+
+        Args:
+            timeout (float, optional): The maximum number of seconds to wait. Defaults to
+                waiting as long as it takes.
+
+        Returns:
+            bool: True if all queued rows were written, or False if the timeout ran out
+            first (in which case any remaining rows are still written in the background).
+
+        """
+        if timeout == None:
+            self._queue.join()
+        else:
+            end = time.time() + timeout
+            with self._queue.all_tasks_done:
+                while self._queue.unfinished_tasks and time.time() < end:
+                    self._queue.all_tasks_done.wait(end - time.time())
+        self._check()
+        return self._queue.unfinished_tasks == 0
+
+    def stats(self):
+        """Returns a dict of queue depth and write latency measures for the session.
+
+        """
+        stats = {'rows': self.rows_written, 'batches': len(self.flush_times)}
+        if len(self.flush_times):
+            write_ms = [t / 1e6 for t in self.flush_times]
+            stats['write_ms_mean'] = sum(write_ms) / len(write_ms)
+            stats['write_ms_max'] = max(write_ms)
+        if len(self.queue_depths):
+            stats['queue_depth_mean'] = sum(self.queue_depths) / float(len(self.queue_depths))
+            stats['queue_depth_max'] = max(self.queue_depths)
+            stats['add_wait_ms_max'] = max(self.wait_times) / 1e6
+        return stats
+
+    def close(self):
+        """Writes any remaining rows, then stops the writer thread and closes the database.
+
+        """
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        self._check()
@@ -0,0 +1,154 @@
+__author__ = "Austin Hurst"
+
+import ctypes
+import random
+import threading
+
+import sdl2
+
+from FrameTiming import perf_counter_ns
+
+try:
+    from time import process_time as cpu_time
+except ImportError:
+    from time import clock as cpu_time # Python 2
+
+
+def _push_key(keycode):
+    for etype in [sdl2.SDL_KEYDOWN, sdl2.SDL_KEYUP]:
+        e = sdl2.SDL_Event()
+        e.type = etype
+        e.key.timestamp = sdl2.SDL_GetTicks()
+        e.key.state = sdl2.SDL_PRESSED if etype == sdl2.SDL_KEYDOWN else sdl2.SDL_RELEASED
+        e.key.keysym.sym = keycode
+        e.key.keysym.scancode = sdl2.SDL_GetScancodeFromKey(keycode)
+        sdl2.SDL_PushEvent(ctypes.byref(e))
+
+
+def _push_click(x, y):
+    for etype in [sdl2.SDL_MOUSEBUTTONDOWN, sdl2.SDL_MOUSEBUTTONUP]:
+        e = sdl2.SDL_Event()
+        e.type = etype
+        e.button.timestamp = sdl2.SDL_GetTicks()
+        e.button.button = sdl2.SDL_BUTTON_LEFT
+        e.button.state = sdl2.SDL_PRESSED if etype == sdl2.SDL_MOUSEBUTTONDOWN else sdl2.SDL_RELEASED
+        e.button.clicks = 1
+        e.button.x, e.button.y = int(x), int(y)
+        sdl2.SDL_PushEvent(ctypes.byref(e))
+
+
+class VirtualParticipant(object):
+    """A scripted participant that responds to the task with synthetic SDL input events.
+
+    Responses are scheduled on background timers and pushed onto the SDL event queue, so
+    they pass through exactly the same input handling as a real participant's responses.
+    SART response times are drawn from a normal distribution, and the participant fails
+    to withhold responses to targets (commission errors) and misses non-targets (omission
+    errors) at the given rates. Thought probes are answered by clicking a random answer.
+
+    The participant also keeps throughput statistics for the session, which are written
+    to a benchmark report with :meth:`report`.
+
+    Args:
+        rt_mean (float): The mean SART response time (in ms).
+        rt_sd (float): The standard deviation of SART response times (in ms).
+        commission_rate (float): The proportion of target trials responded to.
+        omission_rate (float): The proportion of non-target trials not responded to.
+        probe_rt (float): The time (in ms) taken to answer thought probes and prompts.
+        seed (int, optional): The random seed to use for the participant's responses.
+
+    """
+    def __init__(self, rt_mean, rt_sd, commission_rate, omission_rate, probe_rt, seed=None):
+        self.rt_mean = rt_mean
+        self.rt_sd = rt_sd
+        self.commission_rate = commission_rate
+        self.omission_rate = omission_rate
+        self.probe_rt = probe_rt
+        self.random = random.Random(seed)
+        self._timers = []
+
+        self.session_start = perf_counter_ns()
+        self.cpu_start = cpu_time()
+        self.trials = 0
+        self.render_ns = []
+
+    def _after(self, delay_ms, func, *args):
+        t = threading.Timer(delay_ms / 1000.0, func, args)
+        t.daemon = True
+        t.start()
+        self._timers = [timer for timer in self._timers if timer.is_alive()] + [t]
+
+    def press(self, key=' ', delay=None):
+        """Presses a key after a delay (in ms), defaulting to the participant's probe RT.
+
+        """
+        keycode = sdl2.SDL_GetKeyFromName(key.encode('utf-8')) if key != ' ' else sdl2.SDLK_SPACE
+        self._after(self.probe_rt if delay == None else delay, _push_key, keycode)
+
+    def sart_response(self, is_target):
+        """Schedules the participant's response (if any) to a SART stimulus.
+
+        """
+        error_rate = self.commission_rate if is_target else self.omission_rate
+        responds = (self.random.random() < error_rate) == is_target
+        if responds:
+            rt = max(self.random.gauss(self.rt_mean, self.rt_sd), 100)
+            self.press(' ', rt)
+
+    def answer_probe(self, probe):
+        """Schedules a click on a random answer of a thought probe.
+
+        """
+        targets = probe.targets()
+        x, y = targets[self.random.choice(sorted(targets.keys()))]
+        self._after(self.probe_rt, _push_click, x, y)
+
+    def cancel(self):
+        for t in self._timers:
+            t.cancel()
+        self._timers = []
+
+    def log_trial(self, render_ns):
+        self.trials += 1
+        self.render_ns.append(render_ns)
+
+    def report(self, path, writer=None, responses=None):
+        """Writes a summary of session throughput to a text file.
+
+        If a :class:`KeyResponse` collector is given, the input lag of its responses is
+        also included in the summary.
+
+        """
+        elapsed = (perf_counter_ns() - self.session_start) / 1e9
+        cpu = cpu_time() - self.cpu_start
+        render_ms = sorted(t / 1e6 for t in self.render_ns)
+        lines = [
+            "trials: {0}".format(self.trials),
+            "elapsed_s: {0:.2f}".format(elapsed),
+            "trials_per_s: {0:.3f}".format(self.trials / elapsed if elapsed else 0),
+            "cpu_s: {0:.2f}".format(cpu),
+            "cpu_percent: {0:.1f}".format(100 * cpu / elapsed if elapsed else 0),
+        ]
+        if len(render_ms):
+            lines += [
+                "render_ms_mean: {0:.3f}".format(sum(render_ms) / len(render_ms)),
+                "render_ms_max: {0:.3f}".format(render_ms[-1]),
+            ]
+        if responses and responses.jitter():
+            mean, sd, worst = responses.jitter()
+            lines += [
+                "input_lag_ms_mean: {0:.3f}".format(mean),
+                "input_lag_ms_sd: {0:.3f}".format(sd),
+                "input_lag_ms_max: {0:.3f}".format(worst),
+            ]
+        if writer:
+            stats = writer.stats()
+            lines.append("db_rows: {0}".format(stats['rows']))
+            lines.append("db_batches: {0}".format(stats['batches']))
+            for key in ['write_ms_mean', 'write_ms_max', 'queue_depth_mean', 'queue_depth_max',
+                        'add_wait_ms_max']:
+                if key in stats:
+                    lines.append("db_{0}: {1:.3f}".format(key, stats[key]))
+        with open(path, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        return lines
@@ -5,19 +5,31 @@ __author__ = "Austin Hurst"
 import klibs
 from klibs import P
 from klibs.KLExceptions import TrialException
-from klibs.KLUtilities import deg_to_px, pump, flush, show_mouse_cursor, hide_mouse_cursor
+from klibs.KLUtilities import deg_to_px, flush
 from klibs.KLGraphics import fill, flip, blit
-from klibs.KLUserInterface import any_key, key_pressed, ui_request
+from klibs.KLUserInterface import any_key
 from klibs.KLGraphics import KLDraw as kld
 from klibs.KLCommunication import message
-from klibs.KLResponseCollectors import KeyPressResponse, Response
-from klibs.KLTime import CountDown
 
+import os
 import random
 import time
 import sdl2
 
-from InterfaceExtras import ThoughtProbe, LikertType
+from ProbeRegistry import ProbeRegistry
+from StimulusAtlas import ArrayCache, DigitAtlas, composite
+from StaticFrame import StaticFrame
+from FrameTiming import FrameTimer, perf_counter_ns
+from TrialWriter import TrialWriter
+from RemoteWriter import RemoteWriter
+from VirtualParticipant import VirtualParticipant
+from ProbeSchedule import ProbeSchedule
+from TextCache import text_cache
+from KeyResponse import KeyResponse
+from SessionCheckpoint import SessionCheckpoint, remove_participant
+from TrialSequence import TrialSequence
+from PhaseProfiler import profiler, profiled
+from EventLog import event_log
 
 MID_RED = (255, 128, 128, 255)
 MID_GREEN =  (128, 255, 128, 255)
@@ -26,6 +38,7 @@ TRANSPARENT_GREY = (192, 192, 192, 64)
 
 class ProbeComparison(klibs.Experiment):
 
+    @profiled('setup')
     def setup(self):
 
         # Initialize stimulus sizes
@@ -36,110 +49,172 @@ class ProbeComparison(klibs.Experiment):
 
         # Initialize text styles
 
-        self.txtm.add_style('normal', '0.7deg')
-        self.txtm.add_style('title', '1.0deg')
+        self.styles = {'normal': '0.7deg', 'title': '1.0deg'}
+        for name, size in self.styles.items():
+            self.txtm.add_style(name, size)
 
-        self.mask_x = kld.Asterisk(mask_size_x, mask_thick, fill=P.default_color, spokes=8)
-        self.mask_ring = kld.Annulus(mask_size_ring, mask_thick, fill=P.default_color)
+        mask_x = kld.Asterisk(mask_size_x, mask_thick, fill=P.default_color, spokes=8)
+        mask_ring = kld.Annulus(mask_size_ring, mask_thick, fill=P.default_color)
+        self.mask = composite(mask_ring.render(), mask_x.render())
+        self.timer = FrameTimer(P.refresh_rate)
+        self.mask_frame = StaticFrame(
+            lambda: blit(self.mask, 5, P.screen_c), flip=lambda: self.timer.flip('mask_on')
+        )
 
-        self.digits = {}
-        digits = [1, 2, 3, 4, 5, 6, 7, 8, 9]
-        for digit in digits:
-            self.digits[digit] = {}
-        
-        self.sizes = ['1.5deg', '2.0deg', '2.5deg', '3.0deg', '3.5deg']
+        # Initialize digit stimuli (rendered once, or loaded from cache)
+
+        self.sizes = list(P.digit_sizes)
         for size in self.sizes:
             self.txtm.add_style(size, size)
 
-        for digit in digits:
-            for size in self.sizes:
-                self.digits[digit][size] = message(str(digit), style = size, blit_txt = False)
+        cache = ArrayCache(os.path.join(P.local_dir, 'cache'))
+        self.digits = DigitAtlas(P.digits, self.sizes, cache)
+        self.digits.upload()
+
+        # Pre-render text that gets shown repeatedly during the task
+
+        messages = [
+            {'text': "Press the [space] key to start.", 'style': 'normal'},
+            {'text': "Press the [space] key to continue.", 'style': 'title'},
+        ]
+        for practicing in [True, False]:
+            messages.append({'text': self._block_text(practicing), 'style': 'normal', 'align': 'center'})
+        if P.run_practice_blocks:
+            for accuracy, correct_resp in [(True, 'go'), (False, 'go'), (False, 'nogo')]:
+                messages.append({'text': self._feedback_text(accuracy, correct_resp), 'style': 'normal'})
+        text_cache.warm(messages)
+
+        # Initialize background trial data writer
+
+        db_path = P.database_local_path if P.multi_user else P.database_path
+        if P.collector_address:
+            spool_dir = os.path.join(P.local_dir, 'spool')
+            self.writer = RemoteWriter(P.collector_address, P.primary_table, spool_dir)
+        else:
+            self.writer = TrialWriter(db_path, P.primary_table)
+
+        # Initialize scripted participant for automated runs, if enabled
+
+        self.vp = None
+        if P.virtual_participant:
+            speed = float(P.vp_speed)
+            self.vp = VirtualParticipant(
+                P.vp_rt_mean / speed, P.vp_rt_sd / speed, P.vp_commission_rate,
+                P.vp_omission_rate, P.vp_probe_rt / speed, seed=P.random_seed
+            )
+            StaticFrame.redraw_while_held = P.vp_busy_frames
+            StaticFrame.time_scale = 1.0 / speed
+
+        # Resume the last incomplete session on this station, if requested
+
+        self.checkpoint = SessionCheckpoint(os.path.join(P.local_dir, 'checkpoints'))
+        resume = self.checkpoint.resume() if P.resume_session else None
+        if resume:
+            # The session continues under its original id, so remove the participant
+            # record klibs just created for this launch instead of leaving it with no data
+            if P.participant_id != resume['participant_id']:
+                remove_participant(db_path, P.participant_id)
+            P.participant_id = resume['participant_id']
+            P.condition = resume['condition']
+            P.random_seed = resume['random_seed']
+        else:
+            self.checkpoint.start(P.participant_id, P.condition, P.random_seed)
+
+        # Send the participant's record to the collector, so it can give them a unique id
+
+        if P.collector_address:
+            self.writer.add_participant(db_path, P.participant_id)
+
+        # Log all input events for the session to a binary file, if enabled
+
+        if P.log_input_events:
+            log_name = "p{0}_{1}.evlog".format(P.participant_id, int(time.time()))
+            event_log.open(os.path.join(P.data_dir, "events", log_name))
 
         # Initialize thought probes
 
+        probes_path = os.path.join(P.config_dir, P.project_name + "_probes.json")
+        registry = ProbeRegistry(probes_path, cache, self.styles)
         self.probe_condition = P.condition_map[P.condition]
-        self.probe = self._init_probe(self.probe_condition)
+        self.probe = registry.build(self.probe_condition)
 
-        # Randomly distribute probes across session, avoiding placing them less than 20 sec. apart
+        # Randomly distribute probes across session, avoiding placing them too close together
 
-        self.probe_trials = []
-        noprobe_span = [False] * P.noprobe_span
-        probe_span = [True] + [False] * (P.probe_span - 1)
-        while len(self.probe_trials) < (P.trials_per_block * P.blocks_per_experiment):
-            random.shuffle(probe_span)
-            self.probe_trials += noprobe_span + probe_span
+        self.probe_trials = ProbeSchedule(
+            P.trials_per_block * P.blocks_per_experiment, P.probe_span, P.noprobe_span,
+            P.trial_duration, P.probe_min_interval, seed=P.random_seed
+        )
+
+        # Speed up the task for scripted runs (after generating the probe schedule, which
+        # checks probe spacing against the real trial duration)
+
+        if self.vp:
+            P.stim_duration /= float(P.vp_speed)
+            P.trial_duration /= float(P.vp_speed)
 
         # Show task instructions and example thought probe
 
-        self.instructions()
+        if not resume:
+            self.instructions()
 
         # Add practice blocks to start of task
 
         self.first_nonpractice = 1
         if P.run_practice_blocks:
             num_nonpractice = P.blocks_per_experiment
-            self.insert_practice_block(1, trial_counts=9)
-            self.insert_practice_block(2, trial_counts=9)
+            self.insert_practice_block(1, trial_counts=P.practice_trials)
+            self.insert_practice_block(2, trial_counts=P.practice_trials)
             self.first_nonpractice = P.blocks_per_experiment - num_nonpractice + 1
 
-    
-    def _init_probe(self, probetype):
-
-        p_origin = (P.screen_c[0], P.screen_x//10)
-
-        if probetype == 'christoff2009':
-            q = ("What was your attention focused on just before the probe?\n"
-                 "1 (on-task) - 7 (off-task)")
-            title = message(q, "title", align='center', blit_txt=False)
-            return LikertProbe(1, 7, title, int(P.screen_x*0.6), p_origin)
-
-        elif probetype == 'killingsworth2010':
-            q = "Are you thinking about something other than\nwhat you're currently doing?"
-            responses = {
-                'on_task': "No",
-                'mw_pleasant': "Yes, something pleasant",
-                'mw_neutral': "Yes, something neutral",
-                'mw_unpleasant': "Yes, something unpleasant"
-            }
-            order = ['on_task', 'mw_pleasant', 'mw_neutral', 'mw_unpleasant']
-            title = message(q, "title", align='center', blit_txt=False)
-            return ThoughtProbe(responses, title, int(P.screen_x*0.6), p_origin, order)
-
-        elif probetype == 'mason2007':
-            q = "Were you just having an irrelevant thought?\n\n"
-            responses = {
-                'irrelevant': "Yes",
-                'relevant': "No",
-            }
-            order = ['irrelevant', 'relevant']
-            title = message(q, "title", align='center', blit_txt=False)
-            return ThoughtProbe(responses, title, int(P.screen_x*0.6), p_origin, order)
-
-        elif probetype == 'mcvay2009':
-            q = "What were you just thinking about?"
-            responses = {
-                'task': "The task",
-                'performance': "Task experience/performance",
-                'everyday': "Everyday stuff",
-                'currentstate': "Current state of being",
-                'worries': "Personal worries",
-                'daydreams': "Daydreams",
-                'other': "Other"
-            }
-            order = [
-                'task', 'performance', 'everyday', 'currentstate', 'worries',
-                'daydreams', 'other'
-            ]
-            title = message(q, "title", align='center', blit_txt=False)
-            return ThoughtProbe(responses, title, int(P.screen_x*0.6), p_origin, order)
-        
-        elif probetype == 'mrazek2013':
-            q = ("To what extent was your attention focused on the task\n"
-                 "or to task-unrelated concerns?")
-            title = message(q, "title", align='center', blit_txt=False)
-            return LikertProbe(1, 5, title, int(P.screen_x*0.45), p_origin)
+        # Generate the digits and digit sizes for every trial of the session
+
+        self.sequence = TrialSequence(
+            P.blocks_per_experiment, P.trials_per_block, P.digits,
+            len(self.sizes), P.target, P.max_digit_run, P.max_size_run, P.min_target_gap,
+            seed=P.random_seed
+        )
+
+        # If resuming, skip to the start of the block after the one the session was
+        # interrupted in, so that no trials already in the database are run again
+
+        self.resume_block = None
+        if resume:
+            interrupted = resume['block']
+            self.probe_trials.cursor = resume['probe_cursor']
+            if interrupted >= self.first_nonpractice:
+                self.probe_trials.cursor += P.trials_per_block
+            random.setstate(resume['random_state'])
+            self.blocks.i = interrupted
+            self.resume_block = interrupted + 1
+
+
+    def _block_text(self, practicing):
+
+        header = ""#"Block {0} of {1}".format(P.block_number, P.blocks_per_experiment)
+        instructions = (
+            "Please press the space key quickly when a digit other than {0} \nappears on screen, "
+            "and withhold your response when the digit is {0}.".format(P.target)
+        )
+        if practicing:
+            header = "This is a practice block."
+            instructions = instructions + "\nYou will be given feedback on your accuracy."
+        return header+"\n\n"+instructions
+
+
+    def _feedback_text(self, accuracy, correct_resp):
+
+        if accuracy == False:
+            feedback = "Incorrect! "
+            if correct_resp == 'nogo':
+                feedback += "Please withhold responses to the digit {0}.".format(P.target)
+            else:
+                feedback += "Please respond quickly to digits other than {0}.".format(P.target)
+        else:
+            feedback = "Correct response!"
+        return feedback
 
 
+    @profiled('instructions')
     def instructions(self):
 
         p1 = ("During this task, you will presented with a sequence of numbers in the middle of "
@@ -161,31 +236,26 @@ class ProbeComparison(klibs.Experiment):
         fill()
         blit(msg1, 5, P.screen_c)
         flip()
+        if self.vp:
+            self.vp.press()
         any_key(allow_mouse_click=False)
 
         # Example stimuli
 
-        numlist = [1, 2, 3, 4, 5, 6, 7, 8, 9]
+        numlist = list(P.digits)
         random.shuffle(numlist)
         for n in numlist[1:5]:
-            trialtime = CountDown(1.125)
-            numsize = random.choice(self.sizes)
-            while trialtime.counting():
-                ui_request()
-                fill()
-                mask_on = trialtime.elapsed() > 0.25
-                if mask_on:
-                    blit(self.mask_x, 5, P.screen_c)
-                    blit(self.mask_ring, 5, P.screen_c)
-                else:
-                    blit(self.digits[n][numsize], 5, P.screen_c)
-                flip()
+            size = random.choice(self.sizes)
+            StaticFrame(lambda: self.digits.blit(n, size, 5, P.screen_c)).hold(duration=0.25)
+            self.mask_frame.hold(duration=0.875)
         
         # Task explanation/illustration
 
         fill()
         blit(msg2, 5, P.screen_c)
         flip()
+        if self.vp:
+            self.vp.press()
         any_key(allow_mouse_click=False)
 
         # Probe explanation + example probe
@@ -193,131 +263,122 @@ class ProbeComparison(klibs.Experiment):
         fill()
         blit(msg3, 5, P.screen_c)
         flip()
+        if self.vp:
+            self.vp.press()
         any_key()
+        if self.vp:
+            self.vp.answer_probe(self.probe)
         self.probe.collect()
 
 
+    @profiled('block')
     def block(self):
 
-        # Generate font sizes to use for numbers during the block
+        # Checkpoint the session once all earlier trials are safely in the database. When
+        # streaming to a collector, don't keep the participant waiting if it's slow or
+        # offline: just skip the checkpoint until the rows have caught up.
 
-        self.num_sizes = []
-        while len(self.num_sizes) <= P.trials_per_block:
-            self.num_sizes = self.num_sizes + self.sizes
-        random.shuffle(self.num_sizes)
-        self.num_sizes = self.num_sizes[0:P.trials_per_block]
+        wait = P.collector_flush_wait if P.collector_address else None
+        with profiler.phase('db'):
+            flushed = self.writer.flush(timeout=wait)
+            event_log.flush()
+        event_log.set_trial(P.block_number, 0)
+        if flushed:
+            self.checkpoint.save(P.block_number, self.probe_trials.cursor, random.getstate())
 
-        # Generate block message
+        # Get block message
 
-        header = ""#"Block {0} of {1}".format(P.block_number, P.blocks_per_experiment)
-        instructions = (
-            "Please press the space key quickly when a digit other than {0} \nappears on screen, "
-            "and withhold your response when the digit is {0}.".format(P.target)
-        )
-        if P.practicing:
-            header = "This is a practice block."
-            instructions = instructions + "\nYou will be given feedback on your accuracy."
-        msg = message(header+"\n\n"+instructions, 'normal', align="center", blit_txt=False)
-        start_msg = message("Press the [space] key to start.", 'normal', blit_txt=False)
+        msg = text_cache.render(self._block_text(P.practicing), 'normal', align="center")
+        start_msg = text_cache.render("Press the [space] key to start.", 'normal')
 
         # Show block message, and wait for input before staring block
 
-        if P.block_number in [1, self.first_nonpractice]:
-            message_interval = CountDown(2)
-            while message_interval.counting():
-                ui_request() # Allow quitting during loop
-                fill()
-                blit(msg, 8, (P.screen_c[0], int(P.screen_y*0.15)))
-                flip()
-
-            while True:
-                if key_pressed(' '):
-                    break
-                fill()
-                blit(msg, 8, (P.screen_c[0], int(P.screen_y*0.15)))
-                blit(start_msg, 5, (P.screen_c[0], int(P.screen_y*0.75)))
-                flip()
+        def draw_msg():
+            blit(msg, 8, (P.screen_c[0], int(P.screen_y*0.15)))
+
+        def draw_msg_and_start():
+            draw_msg()
+            blit(start_msg, 5, (P.screen_c[0], int(P.screen_y*0.75)))
+
+        if P.block_number in [1, self.first_nonpractice, self.resume_block]:
+            StaticFrame(draw_msg).hold(duration=2)
+            if self.vp:
+                self.vp.press()
+            StaticFrame(draw_msg_and_start).hold(key=' ')
             
     
     def setup_response_collector(self):
 
-        # Configure ResponseCollector for collecting responses via keyboard
+        # Configure low-latency collector for keypress responses to SART stimuli
 
-        self.rc.uses([KeyPressResponse])
-        self.rc.display_callback = self.sart_callback
-        self.rc.end_collection_event = 'trial_end'
-        self.rc.keypress_listener.interrupts = True
-        self.rc.keypress_listener.key_map = {' ': 'go'}
+        self.sart_rc = KeyResponse({' ': 'go'})
 
 
+    @profiled('trial_prep')
     def trial_prep(self):
 
         # Set trial flags
 
         self.mask_on = False
-        self.num_size = self.num_sizes.pop()
-        self.probe_trial = False if P.practicing else self.probe_trials.pop(0)
+        # Take digit and size from the session's sequence instead of the 'number' factor
+        self.number, size = self.sequence.trial(P.block_number, P.trial_number)
+        self.num_size = self.sizes[size]
+        self.probe_trial = False if P.practicing else self.probe_trials.next()
 
         # Specifiy sequence/onsets of events for the trial
 
-        self.evm.register_ticket(['mask_on', P.stim_duration])
         self.evm.register_ticket(['trial_end', P.trial_duration])
+        self.timer.start_trial()
+        event_log.set_trial(P.block_number, P.trial_number)
 
 
+    @profiled('trial')
     def trial(self):
 
-        fill()
-        blit(self.digits[self.number][self.num_size], 5, P.screen_c)
-        flip()
-        
-        self.rc.collect()
-        response = self.rc.keypress_listener.response()
+        render_start = perf_counter_ns()
+        with profiler.phase('render'):
+            fill()
+            self.digits.blit(self.number, self.num_size, 5, P.screen_c)
+            render_end = perf_counter_ns()
+            self.timer.flip('stim_on')
+        if self.vp:
+            self.vp.sart_response(self.number == P.target)
+            self.vp.log_trial(render_end - render_start)
         
-        if response.rt == klibs.TIMEOUT:
-            resp, rt = ['nogo', 'NA']
-        else:
-            resp, rt = response
+        self.sart_rc.onset()
+        # Request the mask flip half a refresh early, so it lands on the vsync closest to
+        # the intended mask onset instead of the one after it
+        mask_at = P.stim_duration - self.timer.frame_ns / 2e6
+        mask_on = [(mask_at, self.sart_callback)]
+        with profiler.phase('input'):
+            resp, rt, input_lag = self.sart_rc.collect(P.trial_duration, actions=mask_on)
+        if resp == None:
+            resp = 'nogo'
         correct_resp = 'nogo' if self.number == P.target else 'go'
         accuracy = resp == correct_resp
 
-        while self.evm.before('trial_end'):
-            ui_request()
-            fill()
-            blit(self.mask_x, 5, P.screen_c)
-            blit(self.mask_ring, 5, P.screen_c)
-            flip()
+        if self.evm.before('trial_end'):
+            self.mask_frame.hold(until=lambda: self.evm.after('trial_end'))
+        self.timer.stamp('trial_end')
 
         if P.practicing:
-            if accuracy == False:
-                feedback = "Incorrect! "
-                if correct_resp == 'nogo':
-                    feedback += "Please withhold responses to the digit {0}.".format(P.target)
-                else:
-                    feedback += "Please respond quickly to digits other than {0}.".format(P.target)
-            else:
-                feedback = "Correct response!"
-            feedback_msg = message(feedback, 'normal', blit_txt=False)
-            feedback_timer = CountDown(1.5)
-            while feedback_timer.counting():
-                ui_request()
-                fill()
-                blit(feedback_msg, 5, P.screen_c)
-                flip()
+            feedback_msg = text_cache.render(self._feedback_text(accuracy, correct_resp), 'normal')
+            StaticFrame(lambda: blit(feedback_msg, 5, P.screen_c)).hold(duration=1.5)
 
         # If probe trial, present MW probe and wait for response + keypress before ending trial
 
         if self.probe_trial:
+            if self.vp:
+                self.vp.answer_probe(self.probe)
             probe_resp, probe_rt = self.probe.collect()
             probe_rt = probe_rt * 1000 # convert seconds to ms
-            resume_msg = message("Press the [space] key to continue.", 'title', blit_txt=False)
-            while True:
-                if key_pressed(' '):
-                    break
-                fill()
-                blit(resume_msg, 5, P.screen_c)
-                flip()
+            self._log_trajectory()
+            resume_msg = text_cache.render("Press the [space] key to continue.", 'title')
+            if self.vp:
+                self.vp.press()
+            StaticFrame(lambda: blit(resume_msg, 5, P.screen_c)).hold(key=' ')
         else:
-            probe_resp, probe_rt = ('NA', 'NA')
+            probe_resp, probe_rt = (None, None)
 
         return {
             "probe_type": self.probe_condition,
@@ -329,55 +390,62 @@ class ProbeComparison(klibs.Experiment):
             "target_digit": P.target,
             "response": resp,
             "rt": rt,
+            "input_lag_ms": input_lag,
             "accuracy": accuracy,
             "probe_resp": probe_resp,
-            "probe_rt": probe_rt
+            "probe_rt": probe_rt,
+            "stim_ms": self.timer.elapsed_ms('stim_on', 'mask_on'),
+            "trial_ms": self.timer.elapsed_ms('stim_on', 'trial_end'),
+            "late_frames": self.timer.late_frames('stim_on', 'mask_on', P.stim_duration)
         }
 
 
+    def _log_trajectory(self):
+
+        # Queue the mouse path for the last probe response, along with its summary measures
+        row = self.probe.trajectory_metrics()
+        row.update({
+            "participant_id": P.participant_id,
+            "block_num": P.block_number,
+            "trial_num": P.trial_number,
+            "samples": self.probe.trajectory.samples().astype('<i4').tobytes()
+        })
+        with profiler.phase('db'):
+            self.writer.add(row, table='probe_trajectories')
+
+
     def trial_clean_up(self):
         pass
 
     def clean_up(self):
-        pass
-
+        finished = self.probe_trials.cursor == len(self.probe_trials)
+        if finished and P.collector_address:
+            # klibs only marks the session complete after this, so tell the collector now
+            db_path = P.database_local_path if P.multi_user else P.database_path
+            self.writer.update_session_info(db_path, P.participant_id, complete=True)
+        self.writer.close()
+        event_log.close()
+        if finished:
+            self.checkpoint.finish()
+        if self.vp:
+            self.vp.cancel()
+            report = "benchmark_p{0}.txt".format(P.participant_id)
+            report_path = os.path.join(P.data_dir, report)
+            self.vp.report(report_path, self.writer, self.sart_rc)
+        profiler.write(os.path.join(P.data_dir, "profile", "p{0}".format(P.participant_id)))
+
+    @profiled('db')
+    def __log_trial__(self, trial_data):
+        # Overrides klibs' per-trial database insert, queuing each trial's data to be
+        # written to the database by a background thread instead
+        trial_data['participant_id'] = P.participant_id
+        self.writer.add(trial_data)
+
+    @profiled('render')
     def sart_callback(self):
 
-        if self.evm.after('mask_on') and not self.mask_on:
+        if not self.mask_on:
             fill()
-            blit(self.mask_x, 5, P.screen_c)
-            blit(self.mask_ring, 5, P.screen_c)
-            flip()
+            blit(self.mask, 5, P.screen_c)
+            self.timer.flip('mask_on')
             self.mask_on = True
-
-
-
-class LikertProbe(object):
-
-    def __init__(self, first, last, question, width, origin):
-
-        self.q = question
-        self.width = width
-        self.origin = origin
-
-        height = width / (len(range(first, last+1)) + 2)
-        self.scale = LikertType(first, last, width, height, style='normal')
-
-    def collect(self):
-
-        show_mouse_cursor()
-        onset = time.time()
-
-        while self.scale.response == None:
-            q = pump(True)
-            ui_request(queue=q)
-            fill()
-            blit(self.q, location=self.origin, registration=8)
-            self.scale.response_listener(q)
-            flip()
-
-        response = self.scale.response
-        rt = time.time() - onset
-        hide_mouse_cursor()
-        self.scale.response = None # reset for next time
-        return Response(response, rt)
@@ -0,0 +1,231 @@
+"""Computes SART and thought probe summary measures from ProbeComparison trial data.
+
+Usage:
+
+    python tools/analysis.py [SOURCE] [--window FIRST LAST]
+
+SOURCE can be the project database (the default) or a folder of files written by
+tools/export.py. Three tables are written to ExpAssets/Data/analysis:
+
+- participants.csv: SART performance for each participant
+- preprobe.csv: SART performance in the trials preceding each thought probe
+- probe_responses.csv: the distribution of probe responses for each probe type
+
+All measures are computed with vectorized NumPy operations over the full data set, so
+no per-trial or per-participant Python loops are needed.
+
+"""
+
+__author__ = "Austin Hurst"
+
+import os
+import csv
+import glob
+import argparse
+
+import numpy as np
+
+from project import DATA_DIR, DB_PATH, connect, load_probes
+
+OUTPUT_DIR = os.path.join(DATA_DIR, "analysis")
+
+COLUMNS = [
+    'participant_id', 'probe_type', 'practicing', 'digit', 'target_digit',
+    'response', 'rt', 'probe_resp'
+]
+STR_COLUMNS = ['probe_type', 'response', 'probe_resp']
+
+# Which responses count as mind-wandering for each probe type, as listed in the project's
+# probe config file. For the Likert-type probes, responses above the scale midpoint count
+# as mind-wandering.
+MW_RESPONSES = dict((name, p['mw_responses']) for name, p in load_probes().items())
+
+
+def _from_db(path):
+    db = connect(path)
+    q = "SELECT {0} FROM trials ORDER BY participant_id, id".format(", ".join(COLUMNS))
+    rows = np.array(db.execute(q).fetchall(), dtype=object).reshape(-1, len(COLUMNS))
+    db.close()
+    return dict((c, rows[:, i]) for i, c in enumerate(COLUMNS))
+
+
+def _from_exports(path):
+    cols = dict((c, []) for c in COLUMNS)
+    files = sorted(glob.glob(os.path.join(path, "*.npz")))
+    for f in files:
+        with np.load(f) as data:
+            for c in COLUMNS:
+                cols[c].append(data[c])
+    parquet = sorted(glob.glob(os.path.join(path, "*.parquet")))
+    if len(parquet):
+        import pyarrow.parquet as pq
+        for f in parquet:
+            table = pq.read_table(f, columns=COLUMNS)
+            for c in COLUMNS:
+                cols[c].append(table.column(c).to_numpy(zero_copy_only=False))
+    return dict((c, np.concatenate(v) if len(v) else []) for c, v in cols.items())
+
+
+def load_trials(source=DB_PATH, include_practice=False):
+    """Loads trial data into a dict of NumPy arrays, ordered by participant and trial.
+
+    Missing values are NaN for numeric columns and empty strings for text columns. Each
+    column is converted as a whole, without looping over rows in Python.
+
+    """
+    raw = _from_exports(source) if os.path.isdir(source) else _from_db(source)
+    data = {}
+    for c in COLUMNS:
+        if c in STR_COLUMNS:
+            col = np.asarray(raw[c], dtype=object)
+            data[c] = np.where(np.equal(col, None), "", col).astype(str)
+        else:
+            data[c] = np.asarray(raw[c], dtype=np.float64) # NULLs become NaN
+    data['participant_id'] = data['participant_id'].astype(np.int64)
+
+    if not include_practice:
+        keep = data['practicing'] == 0
+        data = dict((c, v[keep]) for c, v in data.items())
+    # Keep participants contiguous even if rows came from separate files
+    order = np.argsort(data['participant_id'], kind='stable')
+    return dict((c, v[order]) for c, v in data.items())
+
+
+def trial_measures(data):
+    """Returns per-trial boolean arrays for the SART outcomes of interest.
+
+    """
+    target = data['digit'] == data['target_digit']
+    go = data['response'] == 'go'
+    return {
+        'target': target,
+        'commission': target & go,
+        'omission': ~target & ~go,
+        'go_rt': ~target & go & ~np.isnan(data['rt']),
+        'probe': data['probe_resp'] != "",
+    }
+
+
+def _rate(num, denom):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(denom > 0, num / np.maximum(denom, 1), np.nan)
+
+
+def _rt_stats(rt_sum, rt_sq, n):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = rt_sum / n
+        sd = np.sqrt(np.maximum(rt_sq / n - mean ** 2, 0) * n / (n - 1))
+        return mean, sd, sd / mean
+
+
+def mw_flags(probe_type, probe_resp):
+    """Returns a boolean array indicating which probe responses count as mind-wandering.
+
+    """
+    flags = np.zeros(len(probe_resp), dtype=bool)
+    for ptype, responses in MW_RESPONSES.items():
+        flags |= (probe_type == ptype) & np.isin(probe_resp, responses)
+    return flags
+
+
+def participant_summary(data):
+    """Computes overall SART performance for each participant.
+
+    """
+    m = trial_measures(data)
+    ids, idx, inv = np.unique(data['participant_id'], return_index=True, return_inverse=True)
+    count = lambda x: np.bincount(inv, weights=x, minlength=len(ids))
+
+    rt = np.where(m['go_rt'], data['rt'], 0)
+    n_rt = count(m['go_rt'])
+    rt_mean, rt_sd, rt_cv = _rt_stats(count(rt), count(rt ** 2), n_rt)
+    return {
+        'participant_id': ids,
+        'probe_type': data['probe_type'][idx],
+        'trials': count(np.ones(len(inv))),
+        'commission_rate': _rate(count(m['commission']), count(m['target'])),
+        'omission_rate': _rate(count(m['omission']), count(~m['target'])),
+        'rt_mean': rt_mean,
+        'rt_sd': rt_sd,
+        'rt_cv': rt_cv,
+        'probes': count(m['probe']),
+        'mw_rate': _rate(count(mw_flags(data['probe_type'], data['probe_resp'])), count(m['probe'])),
+    }
+
+
+def preprobe_windows(data, first=1, last=10):
+    """Computes SART performance over a window of trials preceding each thought probe.
+
+    The window spans from `last` trials before each probe trial to `first` trials before
+    it (inclusive), and never extends back past the start of a participant's data.
+
+    """
+    m = trial_measures(data)
+    ids, starts, inv = np.unique(data['participant_id'], return_index=True, return_inverse=True)
+    probes = np.flatnonzero(m['probe'])
+    lo = np.maximum(probes - last, starts[inv[probes]])
+    hi = np.maximum(probes - first + 1, lo)
+
+    def window_sum(x):
+        cs = np.concatenate([[0], np.cumsum(x, dtype=np.float64)])
+        return cs[hi] - cs[lo]
+
+    rt = np.where(m['go_rt'], data['rt'], 0)
+    n_rt = window_sum(m['go_rt'])
+    rt_mean, rt_sd, rt_cv = _rt_stats(window_sum(rt), window_sum(rt ** 2), n_rt)
+    return {
+        'participant_id': data['participant_id'][probes],
+        'probe_type': data['probe_type'][probes],
+        'trial_index': probes - starts[inv[probes]],
+        'probe_resp': data['probe_resp'][probes],
+        'mw': mw_flags(data['probe_type'][probes], data['probe_resp'][probes]),
+        'window_trials': hi - lo,
+        'commission_rate': _rate(window_sum(m['commission']), window_sum(m['target'])),
+        'omission_rate': _rate(window_sum(m['omission']), window_sum(~m['target'])),
+        'rt_mean': rt_mean,
+        'rt_cv': rt_cv,
+    }
+
+
+def probe_responses(data):
+    """Counts each response for each probe type, along with their proportions.
+
+    """
+    probe = data['probe_resp'] != ""
+    keys = np.char.add(np.char.add(data['probe_type'][probe], "\t"), data['probe_resp'][probe])
+    combos, counts = np.unique(keys, return_counts=True)
+    ptype = np.array([k.split("\t")[0] for k in combos], dtype=str)
+    resp = np.array([k.split("\t")[1] for k in combos], dtype=str)
+    types, inv = np.unique(ptype, return_inverse=True)
+    totals = np.bincount(inv, weights=counts)[inv]
+    return {
+        'probe_type': ptype,
+        'probe_resp': resp,
+        'count': counts,
+        'proportion': counts / totals,
+    }
+
+
+def write_table(table, path):
+    cols = list(table.keys())
+    with open(path, 'w') as f:
+        out = csv.writer(f, delimiter=',', lineterminator='\n')
+        out.writerow(cols)
+        for row in zip(*[table[c] for c in cols]):
+            out.writerow(row)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('source', nargs='?', default=DB_PATH)
+    parser.add_argument('--window', nargs=2, type=int, default=[1, 10],
+        metavar=('FIRST', 'LAST'), help="pre-probe window, in trials before each probe")
+    args = parser.parse_args()
+
+    data = load_trials(args.source)
+    if not os.path.isdir(OUTPUT_DIR):
+        os.makedirs(OUTPUT_DIR)
+    write_table(participant_summary(data), os.path.join(OUTPUT_DIR, "participants.csv"))
+    write_table(preprobe_windows(data, *args.window), os.path.join(OUTPUT_DIR, "preprobe.csv"))
+    write_table(probe_responses(data), os.path.join(OUTPUT_DIR, "probe_responses.csv"))
+    print("Wrote analysis tables to {0}".format(OUTPUT_DIR))
@@ -0,0 +1,291 @@
+"""Runs a data collection service that lab stations stream their trial data to.
+
+Usage:
+
+    python tools/collector.py [--host HOST] [--port PORT] [--db PATH] [--template PATH]
+
+Stations connect over TCP (set collector_address in ProbeComparison_params.py) and send
+batches of rows as single lines of JSON. Every batch is written in one transaction through
+a single shared database connection, so stations never contend for the database lock, and
+each batch is acknowledged once it has been committed. If a batch can't be written for
+now (e.g. the database is locked by another program), the station is told to retry it
+later. Batches are identified by station and sequence number, so batches resent by a
+station after reconnecting are only ever written once.
+
+Rows are written to their own database (ExpAssets/ProbeComparison_collected.db, unless
+--db is given), which is created with the same tables as the project database. They
+aren't written to the project database itself, since in multi_user mode klibs also
+merges each station's participant records into that at the end of every session, which
+would leave a second record for every participant the collector has already added.
+
+Participant ids are only unique within each station's local database, so each station
+sends its participant records along with its trial data. The collector adds each record
+to the participants table under a new id, and rewrites the participant_id of every row
+from that station to match. (If a session is resumed, its record is sent again and the
+existing id is kept.) Session info rows (e.g. random seeds) replace any session info
+sent for the same participant before, so stations can update them as sessions finish.
+
+Only rows for tables and columns that exist in the database's schema are accepted, so
+the service can't be used to run arbitrary SQL. Even so, there is no authentication, so
+only run it on a trusted lab network.
+
+"""
+
+__author__ = "Austin Hurst"
+
+import json
+import time
+import base64
+import sqlite3
+import argparse
+import threading
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver # Python 2
+
+from project import DB_PATH, COLLECTOR_DB_PATH, connect, table_columns
+
+BATCHES_TABLE = """
+CREATE TABLE IF NOT EXISTS collector_batches (
+  station text not null,
+  batch integer not null,
+  rows integer not null,
+  received real not null,
+  primary key (station, batch)
+)
+"""
+
+
+PARTICIPANTS_TABLE = """
+CREATE TABLE IF NOT EXISTS collector_participants (
+  station_id text not null,
+  local_id integer not null,
+  participant_id integer not null,
+  userid text,
+  created text,
+  primary key (station_id, local_id)
+)
+"""
+
+
+def _decode(obj):
+    # Binary column values are sent by stations as base64 (see RemoteWriter)
+    if '__bytes__' in obj:
+        return sqlite3.Binary(base64.b64decode(obj['__bytes__']))
+    return obj
+
+
+class Collector(object):
+    """Writes batches of rows from any number of stations through one database connection.
+
+    Args:
+        db_path (str): The path of the SQLite database to write to.
+        template (str, optional): The path of a database to copy the tables of (e.g. the
+            project database) if the database to write to doesn't have any yet.
+
+    """
+    def __init__(self, db_path, template=None):
+        self.db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        if template:
+            self._copy_tables(template)
+        self.db.execute(BATCHES_TABLE)
+        self.db.execute(PARTICIPANTS_TABLE)
+        self.db.commit()
+        self.columns = self._schema()
+        self.participants = self._load_participants()
+        self.lock = threading.Lock()
+        self.write_times = [] # in seconds, for monitoring
+        self.duplicates = 0
+
+    def _copy_tables(self, template):
+        # Creates the template database's tables, if the database doesn't have any yet
+        q = "SELECT sql FROM sqlite_master WHERE type = ? AND sql IS NOT NULL " + \
+            "AND name NOT LIKE 'sqlite_%' AND name NOT LIKE 'collector_%'"
+        if self.db.execute(q, ['table']).fetchone() != None:
+            return
+        src = connect(template)
+        try:
+            tables = [r[0] for r in src.execute(q, ['table'])]
+            indexes = [r[0] for r in src.execute(q, ['index'])]
+        finally:
+            src.close()
+        with self.db:
+            for sql in tables + indexes:
+                self.db.execute(sql)
+
+    def _schema(self):
+        # The tables (and their columns) that stations are allowed to write to
+        q = "SELECT name FROM sqlite_master WHERE type = 'table'"
+        tables = [r[0] for r in self.db.execute(q)]
+        tables = [t for t in tables if not t.startswith(('sqlite_', 'collector_'))]
+        return dict((t, set(c for c, kind in table_columns(self.db, t))) for t in tables)
+
+    def _check_names(self, table, cols):
+        if table not in self.columns:
+            raise ValueError("Unknown table '{0}'".format(table))
+        unknown = [c for c in cols if c not in self.columns[table]]
+        if len(unknown):
+            e = "Unknown column(s) in '{0}': {1}".format(table, ", ".join(unknown))
+            raise ValueError(e)
+
+    def _load_participants(self):
+        # Maps (station id, local participant id) to (participant id, userid, created)
+        q = "SELECT station_id, local_id, participant_id, userid, created " + \
+            "FROM collector_participants"
+        return dict(((r[0], r[1]), tuple(r[2:])) for r in self.db.execute(q))
+
+    def _add_participant(self, station_id, row, mapping):
+        # Adds a station's participant record under a new id, unless it was already added
+        # (e.g. when a session is resumed), and returns its id in the collector's database
+        local_id = row.pop('id')
+        key = (station_id, local_id)
+        userid, created = [
+            None if row.get(c) == None else str(row[c]) for c in ('userid', 'created')
+        ]
+        if key in mapping and mapping[key][1:] == (userid, created):
+            return mapping[key][0]
+        cols = sorted(row.keys())
+        q = "INSERT INTO participants ({0}) VALUES ({1})".format(
+            ", ".join(cols), ", ".join(["?"] * len(cols))
+        )
+        participant_id = self.db.execute(q, [row[c] for c in cols]).lastrowid
+        q = "INSERT OR REPLACE INTO collector_participants VALUES (?, ?, ?, ?, ?)"
+        self.db.execute(q, [station_id, local_id, participant_id, userid, created])
+        mapping[key] = (participant_id, userid, created)
+        return participant_id
+
+    def _replace_session_info(self, row):
+        q = "DELETE FROM session_info WHERE participant_id = ?"
+        self.db.execute(q, [row['participant_id']])
+        cols = sorted(row.keys())
+        q = "INSERT INTO session_info ({0}) VALUES ({1})".format(
+            ", ".join(cols), ", ".join(["?"] * len(cols))
+        )
+        self.db.execute(q, [row[c] for c in cols])
+
+    def store(self, station, batch, rows, station_id=None):
+        """Writes a batch of (table, row) pairs, unless the batch has already been written.
+
+        Rows for the participants table are added under new ids, and the participant_id
+        of every other row is changed from the station's local id to the new one. Rows for
+        the session_info table replace any existing session info for their participant.
+
+        Raises a ValueError (without writing anything) if any row is for a table or column
+        that isn't in the database's schema, or belongs to a participant whose record the
+        station never sent.
+
+        """
+        start = time.time()
+        for table, row in rows:
+            self._check_names(table, row.keys())
+
+        with self.lock:
+            mapping = dict(self.participants)
+            try:
+                with self.db:
+                    q = "INSERT INTO collector_batches VALUES (?, ?, ?, ?)"
+                    self.db.execute(q, [station, batch, len(rows), start])
+                    groups = {}
+                    for table, row in rows:
+                        if table == 'participants':
+                            self._add_participant(station_id, dict(row), mapping)
+                            continue
+                        if 'participant_id' in row:
+                            key = (station_id, row['participant_id'])
+                            if key not in mapping:
+                                raise ValueError(
+                                    "No participant record for local participant id "
+                                    "{0}".format(row['participant_id'])
+                                )
+                            row = dict(row, participant_id=mapping[key][0])
+                        if table == 'session_info':
+                            self._replace_session_info(row)
+                            continue
+                        cols = tuple(sorted(row.keys()))
+                        values = tuple(row[c] for c in cols)
+                        groups.setdefault((table, cols), []).append(values)
+                    for (table, cols), values in groups.items():
+                        q = "INSERT INTO {0} ({1}) VALUES ({2})".format(
+                            table, ", ".join(cols), ", ".join(["?"] * len(cols))
+                        )
+                        self.db.executemany(q, values)
+            except sqlite3.IntegrityError:
+                # Batch was committed before but its ack never reached the station
+                if not self._seen(station, batch):
+                    raise
+                self.duplicates += 1
+            self.participants = mapping
+            self.write_times.append(time.time() - start)
+
+    def _seen(self, station, batch):
+        q = "SELECT 1 FROM collector_batches WHERE station = ? AND batch = ?"
+        return self.db.execute(q, [station, batch]).fetchone() != None
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class BatchHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                msg = json.loads(line.decode('utf-8'), object_hook=_decode)
+                self.server.collector.store(
+                    msg['station'], msg['batch'], msg['rows'], msg.get('station_id')
+                )
+                reply = {'ack': msg['batch']}
+            except Exception as e:
+                # Errors like a locked database will go away, so the station should retry
+                reply = {
+                    'error': "{0}: {1}".format(type(e).__name__, e),
+                    'retry': isinstance(e, sqlite3.OperationalError)
+                }
+            self.wfile.write((json.dumps(reply) + "\n").encode('utf-8'))
+            self.wfile.flush()
+
+
+class CollectorServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, collector):
+        socketserver.TCPServer.__init__(self, address, BatchHandler)
+        self.collector = collector
+
+
+def serve(host, port, db_path, template=DB_PATH):
+    collector = Collector(db_path, template)
+    server = CollectorServer((host, port), collector)
+    print("Collecting trial data at {0}:{1} into {2}".format(host, port, db_path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        collector.close()
+    n = len(collector.write_times)
+    if n:
+        mean_ms = sum(collector.write_times) / n * 1000
+        msg = "Wrote {0} batch(es), mean write time {1:.2f} ms, {2} duplicate(s) skipped"
+        print(msg.format(n - collector.duplicates, mean_ms, collector.duplicates))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--db', default=COLLECTOR_DB_PATH, help="the database to write to")
+    parser.add_argument('--template', default=DB_PATH,
+        help="the database to copy tables from when creating a new database")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.db, args.template)
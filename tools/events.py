@@ -0,0 +1,94 @@
+"""Summarizes the binary input event logs written during sessions.
+
+Usage:
+
+    python tools/events.py [--dir PATH] [--type TYPE]
+
+Each session's log (see log_input_events in the params file) is memory-mapped as a NumPy
+structured array, so even logs with millions of events are summarized without reading
+them into memory or parsing any text. For each log, the number of events of each type is
+printed, along with the median and maximum delay between SDL receiving an event and the
+task reading it from the event queue. Use --type to only count one type of event.
+
+"""
+
+__author__ = "Austin Hurst"
+
+import os
+import sys
+import glob
+import argparse
+
+import numpy as np
+
+from project import DATA_DIR, CODE_DIR
+
+sys.path.insert(0, CODE_DIR)
+from EventLog import EVENT_TYPES, read_log
+
+EVENTS_DIR = os.path.join(DATA_DIR, "events")
+
+
+def load_logs(folder=EVENTS_DIR):
+    """Memory-maps every event log in a folder.
+
+    Returns:
+        list: A list of (file name, events) tuples, sorted by file name.
+
+    """
+    logs = []
+    for path in sorted(glob.glob(os.path.join(folder, "*.evlog"))):
+        logs.append((os.path.basename(path), read_log(path)))
+    return logs
+
+
+def queue_delays(events):
+    """Estimates the delay (in ms) between SDL receiving each event and the task reading
+    it from the queue, by aligning the SDL and perf_counter clocks on the event read
+    soonest after it was received.
+
+    """
+    if len(events) == 0:
+        return np.zeros(0)
+    perf_ms = events['perf_ns'] / 1e6
+    sdl_ms = events['sdl_ms'].astype(np.float64)
+    diff = perf_ms - sdl_ms
+    return diff - diff.min()
+
+
+def summarize(name, events, event_type=None):
+    counts = []
+    types = [event_type] if event_type else sorted(EVENT_TYPES.values())
+    codes = dict((v, k) for k, v in EVENT_TYPES.items())
+    for t in types:
+        counts.append(int(np.count_nonzero(events['type'] == codes[t])))
+    delays = queue_delays(events)
+    if len(delays):
+        delay = "{0:>8.1f}{1:>8.1f}".format(np.median(delays), delays.max())
+    else:
+        delay = "{0:>8}{1:>8}".format("-", "-")
+    return "{0:<28}{1:>10}".format(name, len(events)) + \
+        "".join("{0:>14}".format(n) for n in counts) + delay
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--dir', default=EVENTS_DIR, help="the folder of event logs")
+    parser.add_argument(
+        '--type', choices=sorted(EVENT_TYPES.values()), help="only count this type of event"
+    )
+    args = parser.parse_args()
+
+    logs = load_logs(args.dir)
+    if not logs:
+        print("No event logs found in '{0}'.".format(args.dir))
+        sys.exit(0)
+
+    types = [args.type] if args.type else sorted(EVENT_TYPES.values())
+    print("{0:<28}{1:>10}".format("log", "events") +
+        "".join("{0:>14}".format(t) for t in types) + "{0:>8}{1:>8}".format("lag_md", "lag_max"))
+    total = 0
+    for name, events in logs:
+        print(summarize(name, events, args.type))
+        total += len(events)
+    print("\n{0} events in {1} logs".format(total, len(logs)))
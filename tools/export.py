@@ -0,0 +1,232 @@
+"""Streams the trials table into typed, columnar data files (one per participant).
+
+Usage:
+
+    python tools/export.py [--db PATH] [--format {auto,parquet,npz}] [--all]
+        [--chunk-size N]
+
+Trial data is written to ExpAssets/Data/columnar as Parquet files if pyarrow is
+installed, and as NumPy .npz files otherwise. The include/exclude column settings from
+ProbeComparison_params.py are applied the same way as for 'klibs export', and each row
+is joined with the participant's info columns. Only participants added since the last
+export are written unless --all is given. Participants whose sessions haven't finished
+yet (e.g. are still running, or may be resumed) are exported again on the next run, so
+their later trials aren't missed. Use --db to export from another database, such as the
+one written by tools/collector.py.
+
+"""
+
+__author__ = "Austin Hurst"
+
+import os
+import json
+import argparse
+
+import numpy as np
+
+from project import (
+    DATA_DIR, DB_PATH, load_params, connect, table_columns, has_table, participant_info
+)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+EXPORT_DIR = os.path.join(DATA_DIR, "columnar")
+STATE_FILE = os.path.join(EXPORT_DIR, ".last_export.json")
+
+
+def column_kind(sql_type):
+    """Maps a declared SQLite column type to 'int', 'float', or 'str'.
+
+    """
+    if "int" in sql_type or "bool" in sql_type:
+        return 'int'
+    if "real" in sql_type or "float" in sql_type or "double" in sql_type:
+        return 'float'
+    return 'str'
+
+
+def to_array(values, kind):
+    """Converts a list of column values to a typed NumPy array. Integer columns that
+    contain NULLs are stored as floats, with NULL as NaN.
+
+    """
+    if kind == 'str':
+        return np.array(["" if v is None else str(v) for v in values], dtype=str)
+    if kind == 'int' and None not in values:
+        return np.array(values, dtype=np.int64)
+    return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+
+def to_arrow(values, kind):
+    types = {'int': pa.int64(), 'float': pa.float64(), 'str': pa.string()}
+    if kind == 'str':
+        values = [None if v is None else str(v) for v in values]
+    return pa.array(values, type=types[kind])
+
+
+class ParticipantFile(object):
+    """A columnar output file for a single participant's trial data.
+
+    Parquet files are written incrementally, one row group per chunk. NumPy files
+    need to know their full column lengths up front, so their chunks are buffered
+    until the file is closed.
+
+    """
+    def __init__(self, path, columns, fmt):
+        self.path = path
+        self.columns = columns
+        self.fmt = fmt
+        self._chunks = []
+        self._writer = None
+
+    def write(self, rows):
+        cols = list(zip(*rows))
+        if self.fmt == 'parquet':
+            arrays = [to_arrow(list(v), k) for v, (c, k) in zip(cols, self.columns)]
+            batch = pa.Table.from_arrays(arrays, names=[c for c, k in self.columns])
+            if not self._writer:
+                self._writer = pq.ParquetWriter(self.path, batch.schema)
+            self._writer.write_table(batch)
+        else:
+            self._chunks.append(cols)
+
+    def close(self):
+        if self.fmt == 'parquet':
+            if self._writer:
+                self._writer.close()
+            return
+        arrays = {}
+        for i, (col, kind) in enumerate(self.columns):
+            values = []
+            for chunk in self._chunks:
+                values += chunk[i]
+            arrays[col] = to_array(values, kind)
+        np.savez_compressed(self.path, **arrays)
+
+
+def completed(db, info, params, table='trials'):
+    """Returns the set of participant ids whose sessions have finished.
+
+    A session counts as finished if klibs marked it complete in the session_info table,
+    or (if that isn't recorded) if it has a row for the last trial of the last block.
+    Participants with no trials at all (e.g. left behind when a session was resumed
+    under its original id) also count as finished once any later participant has
+    finished, so they never hold back incremental exports.
+
+    """
+    n_blocks = params['blocks_per_experiment'] + (2 if params['run_practice_blocks'] else 0)
+    q = "SELECT DISTINCT participant_id FROM {0} WHERE block_num = ? AND trial_num = ?"
+    reached_end = set(r[0] for r in db.execute(
+        q.format(table), [n_blocks, params['trials_per_block']]
+    ))
+    q = "SELECT DISTINCT participant_id FROM {0}".format(table)
+    has_trials = set(r[0] for r in db.execute(q))
+    done = set()
+    for pid, p in info.items():
+        if p.get('complete') is not None:
+            if p['complete']:
+                done.add(pid)
+        elif pid in reached_end:
+            done.add(pid)
+    if len(done):
+        done.update(pid for pid in info if pid not in has_trials and pid < max(done))
+    return done
+
+
+def export(fmt='auto', export_all=False, chunk_size=5000, db_path=DB_PATH):
+
+    if fmt == 'auto':
+        fmt = 'parquet' if pa else 'npz'
+    elif fmt == 'parquet' and not pa:
+        raise RuntimeError("pyarrow must be installed to export Parquet files.")
+
+    params = load_params()
+    table = params.get('primary_table', 'trials')
+    id_col = params.get('unique_identifier', 'userid')
+    exclude = params.get('exclude_data_cols', [])
+    append = params.get('append_info_cols', [])
+
+    if not os.path.isdir(EXPORT_DIR):
+        os.makedirs(EXPORT_DIR)
+    last_id = 0
+    if os.path.exists(STATE_FILE) and not export_all:
+        with open(STATE_FILE) as f:
+            state = json.load(f)
+        # Participant ids from another database don't tell us anything about this one
+        if state.get('db', DB_PATH) == db_path:
+            last_id = state['last_participant_id']
+
+    db = connect(db_path)
+    info = participant_info(db, last_id)
+    if not len(info):
+        print("No new participants to export.")
+        return
+
+    # Work out the exported columns: participant identifier, trial data, then info cols
+
+    trial_cols = [(c, column_kind(t)) for c, t in table_columns(db, table)]
+    kinds = dict(trial_cols)
+    if has_table(db, 'session_info'):
+        kinds.update((c, column_kind(t)) for c, t in table_columns(db, 'session_info'))
+    kinds.update((c, column_kind(t)) for c, t in table_columns(db, 'participants'))
+    trial_cols = [(c, k) for c, k in trial_cols if c not in exclude + ['id']]
+    info_cols = [(c, kinds.get(c, 'str')) for c in [id_col] + append if c not in exclude]
+    columns = info_cols + trial_cols
+
+    q = "SELECT {0} FROM {1} WHERE participant_id > ? ORDER BY participant_id, id".format(
+        ", ".join(c for c, k in trial_cols), table
+    )
+    pid_index = [c for c, k in trial_cols].index('participant_id')
+
+    ext = ".parquet" if fmt == 'parquet' else ".npz"
+    cursor = db.execute(q, [last_id])
+    current, out, written = None, None, 0
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        # Split each chunk on participant boundaries, joining on participant info
+        start = 0
+        for i in range(len(rows) + 1):
+            pid = rows[i][pid_index] if i < len(rows) else None
+            if i < len(rows) and pid == current:
+                continue
+            if out and i > start:
+                p = info.get(current, {})
+                out.write([tuple(p.get(c) for c, k in info_cols) + r for r in rows[start:i]])
+            if i == len(rows):
+                break
+            if out:
+                out.close()
+                written += 1
+            current, start = pid, i
+            p = info.get(pid, {})
+            fname = "p{0}_{1}{2}".format(p.get(id_col), pid, ext)
+            out = ParticipantFile(os.path.join(EXPORT_DIR, fname), columns, fmt)
+    if out:
+        out.close()
+        written += 1
+
+    # Only skip participants next time if they and everyone before them are finished
+    done = completed(db, info, params, table)
+    for pid in sorted(info.keys()):
+        if pid not in done:
+            break
+        last_id = pid
+    with open(STATE_FILE, 'w') as f:
+        json.dump({'last_participant_id': last_id, 'db': db_path}, f)
+    print("Exported trial data for {0} participant(s) to {1}".format(written, EXPORT_DIR))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--db', default=DB_PATH, help="the database to export from")
+    parser.add_argument('--format', choices=['auto', 'parquet', 'npz'], default='auto')
+    parser.add_argument('--all', action='store_true', help="re-export all participants")
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    args = parser.parse_args()
+    export(args.format, args.all, args.chunk_size, args.db)
@@ -0,0 +1,196 @@
+"""Shows a live summary of each participant's performance while sessions are running.
+
+Usage:
+
+    python tools/monitor.py [--db PATH] [--interval SECONDS] [--all] [--once]
+
+New rows in the trials table are read every few seconds (by id, so rows already seen are
+never read again) and added to running totals for each participant: accuracy on target
+and non-target digits, go-trial RT mean and coefficient of variation, and thought probe
+response counts. Practice trials are skipped unless --all is given.
+
+By default, the databases that running sessions write to are monitored: the collector's
+database if a collector_address is set in the params, otherwise each station's local
+database in ExpAssets/Local if multi_user is set (checking for new ones on every update),
+and otherwise the project database.
+
+The database is opened read-only and each read is a short query, so the monitor can be
+left running alongside active sessions without blocking or slowing down their writes.
+
+"""
+
+__author__ = "Austin Hurst"
+
+import os
+import math
+import time
+import glob
+import argparse
+
+from project import DB_PATH, COLLECTOR_DB_PATH, LOCAL_DIR, connect, has_table, load_params
+
+COLUMNS = [
+    'id', 'participant_id', 'probe_type', 'practicing', 'block_num', 'digit',
+    'target_digit', 'response', 'rt', 'accuracy', 'probe_resp'
+]
+
+
+class ParticipantStats(object):
+    """Running performance totals for a single participant.
+
+    """
+    def __init__(self, probe_type):
+        self.probe_type = probe_type
+        self.trials = 0
+        self.block = None
+        self.targets = 0
+        self.targets_correct = 0
+        self.nontargets = 0
+        self.nontargets_correct = 0
+        self.probes = {}
+        # Running mean and sum of squared deviations of go RTs (Welford's method)
+        self.rt_n = 0
+        self.rt_mean = 0.0
+        self.rt_m2 = 0.0
+        self.updated = None
+
+    def add(self, row):
+        self.trials += 1
+        self.block = row['block_num']
+        self.updated = time.time()
+        if row['digit'] == row['target_digit']:
+            self.targets += 1
+            self.targets_correct += int(bool(row['accuracy']))
+        else:
+            self.nontargets += 1
+            self.nontargets_correct += int(bool(row['accuracy']))
+            if row['response'] == 'go' and row['rt'] is not None:
+                self.rt_n += 1
+                delta = row['rt'] - self.rt_mean
+                self.rt_mean += delta / self.rt_n
+                self.rt_m2 += delta * (row['rt'] - self.rt_mean)
+        if row['probe_resp'] is not None:
+            resp = str(row['probe_resp'])
+            self.probes[resp] = self.probes.get(resp, 0) + 1
+
+    def rt_cv(self):
+        if self.rt_n < 2 or self.rt_mean == 0:
+            return None
+        return math.sqrt(self.rt_m2 / (self.rt_n - 1)) / self.rt_mean
+
+
+def live_databases():
+    """Returns the paths of the databases that running sessions write trials to.
+
+    """
+    params = load_params()
+    if params.get('collector_address'):
+        return [COLLECTOR_DB_PATH]
+    if params.get('multi_user'):
+        return sorted(glob.glob(os.path.join(LOCAL_DIR, "*.db")))
+    return [DB_PATH]
+
+
+class Monitor(object):
+    """Tails the trials tables of one or more project databases, keeping running totals
+    for each participant.
+
+    Args:
+        db_path (str, optional): The path of the database to monitor. Defaults to the
+            databases of any running sessions (see :func:`live_databases`).
+        include_practice (bool, optional): Whether to include practice trials.
+
+    """
+    def __init__(self, db_path=None, include_practice=False):
+        self.db_path = db_path
+        self.include_practice = include_practice
+        self.last_ids = {}
+        self.rows_read = 0
+        self.participants = {}
+
+    def update(self):
+        """Reads any trials added since the last update. Returns the number of new rows.
+
+        """
+        paths = [self.db_path] if self.db_path else live_databases()
+        new = 0
+        for path in paths:
+            if os.path.exists(path):
+                new += self._update(path)
+        return new
+
+    def _update(self, path):
+        db = connect(path)
+        try:
+            if not has_table(db, 'trials'):
+                return 0
+            q = "SELECT {0} FROM trials WHERE id > ? ORDER BY id".format(", ".join(COLUMNS))
+            rows = db.execute(q, [self.last_ids.get(path, 0)]).fetchall()
+        finally:
+            db.close()
+
+        # Station databases each number their own participants, so keep their ids apart
+        shared = path in (DB_PATH, COLLECTOR_DB_PATH)
+        station = None if shared else os.path.splitext(os.path.basename(path))[0]
+        for values in rows:
+            row = dict(zip(COLUMNS, values))
+            self.last_ids[path] = row['id']
+            if row['practicing'] and not self.include_practice:
+                continue
+            pid = row['participant_id']
+            key = (station or "", pid)
+            if key not in self.participants:
+                self.participants[key] = ParticipantStats(row['probe_type'])
+            self.participants[key].add(row)
+        self.rows_read += len(rows)
+        return len(rows)
+
+    def report(self):
+        """Returns a list of lines summarizing each participant's performance so far.
+
+        """
+        label = lambda key: "{0}:{1}".format(*key) if key[0] else str(key[1])
+        w = max([6] + [len(label(key)) for key in self.participants])
+        fmt_line = "{0:>" + str(w) + "} {1:<18}{2:>7}{3:>7}{4:>9}{5:>9}{6:>9}{7:>7}{8:>9}  {9}"
+        lines = [fmt_line.format(
+            "id", "probe_type", "block", "trials", "tgt_acc", "non_acc", "rt_mean", "rt_cv",
+            "idle_s", "probe responses"
+        )]
+        fmt = lambda x, spec: format(x, spec) if x is not None else "-"
+        now = time.time()
+        for key in sorted(self.participants.keys()):
+            p = self.participants[key]
+            tgt = p.targets_correct / float(p.targets) if p.targets else None
+            non = p.nontargets_correct / float(p.nontargets) if p.nontargets else None
+            probes = ", ".join("{0}: {1}".format(r, n) for r, n in sorted(p.probes.items()))
+            lines.append(fmt_line.format(
+                label(key), p.probe_type, p.block, p.trials, fmt(tgt, ".2f"), fmt(non, ".2f"),
+                fmt(p.rt_mean if p.rt_n else None, ".1f"), fmt(p.rt_cv(), ".2f"),
+                "{0:.0f}".format(now - p.updated), probes
+            ))
+        return lines
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--db', help="the database to monitor (default: running sessions)")
+    parser.add_argument('--interval', type=float, default=5.0, help="seconds between updates")
+    parser.add_argument('--all', action='store_true', help="include practice trials")
+    parser.add_argument('--once', action='store_true', help="print one summary and exit")
+    args = parser.parse_args()
+
+    monitor = Monitor(args.db, args.all)
+    try:
+        while True:
+            monitor.update()
+            if not args.once:
+                os.system('cls' if os.name == 'nt' else 'clear')
+            print("\n".join(monitor.report()))
+            if args.once:
+                break
+            print("\nTrials read: {0} (updated {1}, Ctrl-C to quit)".format(
+                monitor.rows_read, time.strftime("%H:%M:%S")
+            ))
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,90 @@
+"""Shared helpers for the ProbeComparison command-line tools.
+
+These tools run outside of klibs, so they read the project's parameters and database
+directly instead of going through the klibs runtime.
+
+"""
+
+__author__ = "Austin Hurst"
+
+import os
+import io
+import json
+import sqlite3
+
+PROJECT_NAME = "ProbeComparison"
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ASSET_DIR = os.path.join(PROJECT_DIR, "ExpAssets")
+CONFIG_DIR = os.path.join(ASSET_DIR, "Config")
+LOCAL_DIR = os.path.join(ASSET_DIR, "Local")
+DATA_DIR = os.path.join(ASSET_DIR, "Data")
+CODE_DIR = os.path.join(ASSET_DIR, "Resources", "code")
+DB_PATH = os.path.join(ASSET_DIR, PROJECT_NAME + ".db")
+COLLECTOR_DB_PATH = os.path.join(ASSET_DIR, PROJECT_NAME + "_collected.db")
+PARAMS_PATH = os.path.join(CONFIG_DIR, PROJECT_NAME + "_params.py")
+PROBES_PATH = os.path.join(CONFIG_DIR, PROJECT_NAME + "_probes.json")
+
+
+def load_params(path=PARAMS_PATH):
+    """Reads the project's params file into a dict, without importing klibs.
+
+    """
+    params = {}
+    with open(path) as f:
+        exec(compile(f.read(), path, 'exec'), params)
+    return dict((k, v) for k, v in params.items() if not k.startswith('__'))
+
+
+def load_probes(path=PROBES_PATH):
+    """Reads the project's thought probe definitions into a dict, keyed by probe name.
+
+    """
+    with io.open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def connect(path=DB_PATH, readonly=True):
+    """Opens the project database. By default the database is opened read-only, so that
+    tools can safely run alongside active sessions without taking write locks.
+
+    """
+    if readonly:
+        uri = "file:{0}?mode=ro".format(path.replace("?", "%3f"))
+        return sqlite3.connect(uri, uri=True)
+    return sqlite3.connect(path)
+
+
+def table_columns(db, table):
+    """Returns a list of (name, declared type) tuples for the columns of a table.
+
+    """
+    return [(row[1], row[2].lower()) for row in db.execute("PRAGMA table_info({0})".format(table))]
+
+
+def has_table(db, table):
+    q = "SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?"
+    return db.execute(q, [table]).fetchone() != None
+
+
+def participant_info(db, min_id=0):
+    """Returns a dict mapping participant ids to dicts of participant info.
+
+    Info from the 'participants' table is merged with any runtime info that klibs stores
+    in the 'session_info' table (e.g. random seeds), if that table exists.
+
+    """
+    info = {}
+    cols = [c for c, t in table_columns(db, 'participants')]
+    q = "SELECT * FROM participants WHERE id > ? ORDER BY id"
+    for row in db.execute(q, [min_id]):
+        p = dict(zip(cols, row))
+        info[p['id']] = p
+
+    if has_table(db, 'session_info'):
+        cols = [c for c, t in table_columns(db, 'session_info')]
+        for row in db.execute("SELECT * FROM session_info WHERE participant_id > ?", [min_id]):
+            s = dict(zip(cols, row))
+            if s['participant_id'] in info:
+                for col, val in s.items():
+                    info[s['participant_id']].setdefault(col, val)
+    return info
@@ -0,0 +1,204 @@
+"""Replays the stimulus schedule of each session and checks it against the trial data.
+
+Usage:
+
+    python tools/replay.py [--db PATH] [--participant ID ...] [--processes N] [--schedule]
+
+The digits, digit sizes, and thought probe placement of every trial in a session are all
+generated from the session's random seed and the project's params (see TrialSequence and
+ProbeSchedule). This regenerates each session's full schedule from its seed, without
+klibs or a window, and compares it against every row of the session in the trials
+table, listing any trials where what was recorded differs from what should have been
+shown. Sessions are replayed in parallel, one per process. (The order of each probe's
+answers is fixed in the project's probe config file, so it doesn't need replaying.)
+
+With --schedule, each replayed schedule is also written to a CSV file in
+ExpAssets/Data/replay, listing what was shown on every trial of the session.
+
+"""
+
+__author__ = "Austin Hurst"
+
+import os
+import sys
+import csv
+import argparse
+from multiprocessing import Pool
+
+from project import DATA_DIR, DB_PATH, CODE_DIR, connect, load_params, participant_info
+
+sys.path.insert(0, CODE_DIR)
+from TrialSequence import TrialSequence
+from ProbeSchedule import ProbeSchedule
+
+OUTPUT_DIR = os.path.join(DATA_DIR, "replay")
+
+COLUMNS = [
+    'block_num', 'trial_num', 'practicing', 'probe_type', 'digit', 'digit_size', 'probe_resp'
+]
+SCHEDULE_COLUMNS = ['block_num', 'trial_num', 'practicing', 'digit', 'digit_size', 'probe']
+
+# Set in each worker process by _init_worker
+_params = None
+_db_path = None
+
+
+def replay(params, seed):
+    """Regenerates the stimulus schedule of a session from its random seed, in the same
+    way as the experiment's setup().
+
+    Returns:
+        dict: A dict mapping (block, trial) numbers to dicts describing each trial.
+
+    """
+    n_practice = 2 if params['run_practice_blocks'] else 0
+    n_blocks = params['blocks_per_experiment'] + n_practice
+    per_block = params['trials_per_block']
+    sizes = params['digit_sizes']
+
+    sequence = TrialSequence(
+        n_blocks, per_block, params['digits'], len(sizes), params['target'],
+        params['max_digit_run'], params['max_size_run'], params['min_target_gap'], seed=seed
+    )
+    probes = ProbeSchedule(
+        per_block * params['blocks_per_experiment'], params['probe_span'],
+        params['noprobe_span'], params['trial_duration'], params['probe_min_interval'],
+        seed=seed
+    )
+
+    schedule = {}
+    for block in range(1, n_blocks + 1):
+        practicing = block <= n_practice
+        n_trials = params['practice_trials'] if practicing else per_block
+        for trial in range(1, n_trials + 1):
+            digit, size = sequence.trial(block, trial)
+            if practicing:
+                probe = False
+            else:
+                probe = probes.schedule[(block - n_practice - 1) * per_block + trial - 1]
+            schedule[(block, trial)] = {
+                'block_num': block, 'trial_num': trial, 'practicing': practicing,
+                'digit': digit, 'digit_size': sizes[size], 'probe': probe
+            }
+    return schedule
+
+
+def compare(schedule, rows, probe_type=None):
+    """Compares a replayed schedule against a session's rows from the trials table.
+
+    Returns:
+        list: A list of strings describing each mismatch.
+
+    """
+    mismatches = []
+    for row in rows:
+        key = (row['block_num'], row['trial_num'])
+        where = "block {0}, trial {1}".format(*key)
+        if key not in schedule:
+            mismatches.append("{0}: trial is not in the replayed schedule".format(where))
+            continue
+        expected = schedule[key]
+        observed = dict(row, probe=row['probe_resp'] is not None)
+        observed['practicing'] = bool(row['practicing'])
+        for col in ['practicing', 'digit', 'digit_size', 'probe']:
+            if observed[col] != expected[col]:
+                mismatches.append("{0}: {1} was {2}, expected {3}".format(
+                    where, col, observed[col], expected[col]
+                ))
+        if probe_type and row['probe_type'] != probe_type:
+            mismatches.append("{0}: probe_type was {1}, expected {2}".format(
+                where, row['probe_type'], probe_type
+            ))
+    return mismatches
+
+
+def _init_worker(params, db_path):
+    global _params, _db_path
+    _params, _db_path = params, db_path
+
+
+def _check_session(args):
+    # Replays and checks a single session (run in a worker process)
+    pid, info, write_schedule = args
+    db = connect(_db_path)
+    try:
+        q = "SELECT {0} FROM trials WHERE participant_id = ? ORDER BY id".format(
+            ", ".join(COLUMNS)
+        )
+        rows = [dict(zip(COLUMNS, r)) for r in db.execute(q, [pid])]
+    finally:
+        db.close()
+
+    seed = info.get('random_seed')
+    if seed is None:
+        return (pid, None, len(rows), 0, ["no random seed recorded for this session"])
+    schedule = replay(_params, seed)
+    probe_type = _params['condition_map'].get(info.get('condition'))
+    mismatches = compare(schedule, rows, probe_type)
+
+    if write_schedule:
+        path = os.path.join(OUTPUT_DIR, "p{0}_schedule.csv".format(pid))
+        with open(path, 'w') as f:
+            out = csv.writer(f, lineterminator="\n")
+            out.writerow(SCHEDULE_COLUMNS)
+            for key in sorted(schedule.keys()):
+                out.writerow([schedule[key][c] for c in SCHEDULE_COLUMNS])
+    return (pid, seed, len(rows), len(schedule), mismatches)
+
+
+def check_sessions(db_path=DB_PATH, participants=None, processes=None, write_schedule=False):
+    """Replays and checks every session (or only those of the given participant ids),
+    split across a pool of worker processes.
+
+    Returns:
+        list: A (participant id, seed, trials recorded, trials scheduled, mismatches)
+        tuple for each session, sorted by participant id.
+
+    """
+    db = connect(db_path)
+    try:
+        info = participant_info(db)
+    finally:
+        db.close()
+    if participants:
+        info = dict((pid, p) for pid, p in info.items() if pid in participants)
+    if write_schedule and not os.path.isdir(OUTPUT_DIR):
+        os.makedirs(OUTPUT_DIR)
+
+    params = load_params()
+    jobs = [(pid, info[pid], write_schedule) for pid in sorted(info.keys())]
+    pool = Pool(processes, initializer=_init_worker, initargs=(params, db_path))
+    try:
+        results = pool.map(_check_session, jobs)
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--db', default=DB_PATH, help="the database to check")
+    parser.add_argument('--participant', type=int, nargs='+', help="only check these ids")
+    parser.add_argument('--processes', type=int, help="the number of worker processes")
+    parser.add_argument('--schedule', action='store_true', help="write replayed schedules")
+    parser.add_argument('--max-listed', type=int, default=10,
+        help="the maximum number of mismatches to list per session")
+    args = parser.parse_args()
+
+    results = check_sessions(args.db, args.participant, args.processes, args.schedule)
+    failed = 0
+    for pid, seed, recorded, scheduled, mismatches in results:
+        status = "OK" if not mismatches else "{0} MISMATCHES".format(len(mismatches))
+        print("participant {0} (seed {1}): {2}/{3} trials recorded, {4}".format(
+            pid, seed, recorded, scheduled, status
+        ))
+        for m in mismatches[:args.max_listed]:
+            print("    " + m)
+        if len(mismatches) > args.max_listed:
+            print("    ... and {0} more".format(len(mismatches) - args.max_listed))
+        failed += int(bool(mismatches))
+    print("\n{0} of {1} sessions matched their replayed schedules".format(
+        len(results) - failed, len(results)
+    ))
+    sys.exit(1 if failed else 0)
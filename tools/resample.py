@@ -0,0 +1,226 @@
+"""Compares thought probe types with bootstrap confidence intervals and permutation tests.
+
+Usage:
+
+    python tools/resample.py [SOURCE] [--window FIRST LAST] [--bootstrap N]
+        [--permutations N] [--seed SEED] [--processes N]
+
+SOURCE can be the project database (the default) or a folder of files written by
+tools/export.py. Each participant is summarized by their mind-wandering rate and SART
+performance (see tools/analysis.py), both overall and in the trials preceding each
+probe. Since each participant only sees one probe type, participants are the unit of
+resampling:
+
+- bootstrap_ci.csv: the mean of each measure for each probe type, with a percentile
+  bootstrap confidence interval from resampling participants within each probe type
+- permutation_tests.csv: for each measure, a permutation test of whether it differs
+  between probe types, from shuffling probe types across participants
+
+Resamples are split into fixed-size chunks, each drawn from its own random stream
+seeded by the chunk's index, and each chunk is computed in a single batch of NumPy
+operations. Chunks are spread across a pool of worker processes, and results are
+identical for a given seed no matter how many processes are used.
+
+"""
+
+__author__ = "Austin Hurst"
+
+import os
+import argparse
+from multiprocessing import Pool
+
+import numpy as np
+
+from analysis import (
+    DB_PATH, OUTPUT_DIR, load_trials, participant_summary, preprobe_windows, write_table
+)
+
+MEASURES = [
+    'mw_rate', 'commission_rate', 'omission_rate', 'rt_mean', 'rt_cv',
+    'preprobe_commission_rate', 'preprobe_rt_cv'
+]
+
+# Set in each worker process by _init_worker
+_values = None
+_groups = None
+_n_groups = None
+
+
+def participant_measures(data, first=1, last=10):
+    """Summarizes each participant by the measures in MEASURES.
+
+    Returns:
+        tuple: The participant ids, their probe types, and an (participants x measures)
+        array of their scores (NaN where a measure can't be computed).
+
+    """
+    summary = participant_summary(data)
+    ids = summary['participant_id']
+    values = np.column_stack([summary[m] for m in MEASURES if not m.startswith('preprobe_')])
+
+    # Average each pre-probe measure across each participant's probes
+    pre = preprobe_windows(data, first, last)
+    inv = np.searchsorted(ids, pre['participant_id'])
+    extra = []
+    for m in ['commission_rate', 'rt_cv']:
+        valid = ~np.isnan(pre[m])
+        total = np.bincount(inv, weights=np.where(valid, pre[m], 0), minlength=len(ids))
+        n = np.bincount(inv, weights=valid, minlength=len(ids))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            extra.append(np.where(n > 0, total / np.maximum(n, 1), np.nan))
+    values = np.column_stack([values] + extra)
+    return ids, summary['probe_type'], values
+
+
+def _rng(seed, stream, chunk):
+    # An independent random stream for each chunk of each kind of resample
+    return np.random.default_rng(np.random.SeedSequence([seed, stream, chunk]))
+
+
+def _group_stats(onehot, values):
+    # Per-group counts and means of each measure (ignoring NaNs), for a batch of group
+    # assignments given as a (resamples x groups x participants) boolean array
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0)
+    sums = np.einsum('bgn,nk->bgk', onehot.astype(np.float64), filled)
+    counts = np.einsum('bgn,nk->bgk', onehot.astype(np.float64), valid.astype(np.float64))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return counts, sums / counts
+
+
+def between_groups(onehot, values):
+    """Computes the between-groups sum of squares of each measure, for each of a batch
+    of group assignments.
+
+    """
+    valid = ~np.isnan(values)
+    grand = np.nansum(values, axis=0) / np.maximum(valid.sum(axis=0), 1)
+    counts, means = _group_stats(onehot, values)
+    ss = counts * (np.nan_to_num(means) - grand) ** 2
+    return ss.sum(axis=1)
+
+
+def _init_worker(values, groups, n_groups):
+    global _values, _groups, _n_groups
+    _values, _groups, _n_groups = values, groups, n_groups
+
+
+def _bootstrap_chunk(args):
+    # Means of each measure for each group, for a chunk of bootstrap resamples
+    seed, chunk, n = args
+    rng = _rng(seed, 0, chunk)
+    out = np.full((n, _n_groups, _values.shape[1]), np.nan)
+    for g in range(_n_groups):
+        rows = np.flatnonzero(_groups == g)
+        idx = rows[rng.integers(0, len(rows), size=(n, len(rows)))]
+        sample = _values[idx]
+        valid = ~np.isnan(sample)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out[:, g] = np.where(valid, sample, 0).sum(axis=1) / valid.sum(axis=1)
+    return out
+
+
+def _permutation_chunk(args):
+    # Between-groups sums of squares for a chunk of random group assignments
+    seed, chunk, n = args
+    rng = _rng(seed, 1, chunk)
+    order = np.argsort(rng.random((n, len(_groups))), axis=1)
+    shuffled = _groups[order]
+    onehot = shuffled[:, None, :] == np.arange(_n_groups)[None, :, None]
+    return between_groups(onehot, _values)
+
+
+def _chunks(seed, total, size):
+    return [(seed, i, min(size, total - i * size)) for i in range(-(-total // size))]
+
+
+def resample(values, groups, n_bootstrap=10000, n_permutations=10000, seed=0,
+             processes=None, chunk_size=250):
+    """Runs bootstrap and permutation resamples of participant measures across a pool of
+    worker processes.
+
+    Args:
+        values (:obj:`np.ndarray`): A (participants x measures) array of scores.
+        groups (:obj:`np.ndarray`): The group (i.e. probe type) index of each participant.
+        n_bootstrap (int, optional): The number of bootstrap resamples.
+        n_permutations (int, optional): The number of permutations.
+        seed (int, optional): The random seed for all resamples.
+        processes (int, optional): The number of worker processes. Defaults to the
+            number of CPUs.
+        chunk_size (int, optional): The number of resamples computed at once per task.
+
+    Returns:
+        tuple: A (resamples x groups x measures) array of bootstrapped group means, and
+        a (permutations x measures) array of permuted between-groups sums of squares.
+
+    """
+    n_groups = int(groups.max()) + 1
+    pool = Pool(processes, initializer=_init_worker, initargs=(values, groups, n_groups))
+    try:
+        boot = pool.map(_bootstrap_chunk, _chunks(seed, n_bootstrap, chunk_size))
+        perm = pool.map(_permutation_chunk, _chunks(seed, n_permutations, chunk_size))
+    finally:
+        pool.close()
+        pool.join()
+    return np.concatenate(boot), np.concatenate(perm)
+
+
+def compare_probe_types(data, first=1, last=10, alpha=0.05, **kwargs):
+    """Computes bootstrap confidence intervals and permutation tests for each measure
+    across probe types.
+
+    Returns:
+        tuple: The bootstrap and permutation test result tables.
+
+    """
+    ids, probe_type, values = participant_measures(data, first, last)
+    types, groups = np.unique(probe_type, return_inverse=True)
+    boot, perm = resample(values, groups, **kwargs)
+
+    onehot = groups[None, :] == np.arange(len(types))[:, None]
+    counts, means = _group_stats(onehot[None], values)
+    with np.errstate(invalid='ignore'):
+        low, high = np.nanpercentile(boot, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+
+    ci = dict((c, []) for c in ['probe_type', 'measure', 'n', 'mean', 'ci_low', 'ci_high'])
+    for g, ptype in enumerate(types):
+        for k, m in enumerate(MEASURES):
+            ci['probe_type'].append(ptype)
+            ci['measure'].append(m)
+            ci['n'].append(int(counts[0, g, k]))
+            ci['mean'].append(means[0, g, k])
+            ci['ci_low'].append(low[g, k])
+            ci['ci_high'].append(high[g, k])
+
+    observed = between_groups(onehot[None], values)[0]
+    exceed = (perm >= observed - 1e-12 * np.abs(observed)).sum(axis=0)
+    tests = {
+        'measure': MEASURES,
+        'between_ss': observed,
+        'p_value': (exceed + 1) / float(len(perm) + 1),
+        'permutations': [len(perm)] * len(MEASURES),
+    }
+    return ci, tests
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('source', nargs='?', default=DB_PATH)
+    parser.add_argument('--window', nargs=2, type=int, default=[1, 10],
+        metavar=('FIRST', 'LAST'), help="pre-probe window, in trials before each probe")
+    parser.add_argument('--bootstrap', type=int, default=10000, help="bootstrap resamples")
+    parser.add_argument('--permutations', type=int, default=10000, help="permutations")
+    parser.add_argument('--seed', type=int, default=0, help="random seed for resampling")
+    parser.add_argument('--processes', type=int, help="the number of worker processes")
+    args = parser.parse_args()
+
+    data = load_trials(args.source)
+    ci, tests = compare_probe_types(
+        data, args.window[0], args.window[1], n_bootstrap=args.bootstrap,
+        n_permutations=args.permutations, seed=args.seed, processes=args.processes
+    )
+    if not os.path.isdir(OUTPUT_DIR):
+        os.makedirs(OUTPUT_DIR)
+    write_table(ci, os.path.join(OUTPUT_DIR, "bootstrap_ci.csv"))
+    write_table(tests, os.path.join(OUTPUT_DIR, "permutation_tests.csv"))
+    print("Wrote resampling results to {0}".format(OUTPUT_DIR))